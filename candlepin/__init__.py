@@ -13,10 +13,10 @@ Account:
 Subscription:
 - Refresh available pools for account
 - Create new pools for subscription
-"""
 
-import account
-import subscription
+Non-blocking variants of the calls above are available in 'deferred', time
+budgets of the calls are managed by 'budget'.
+"""
 
 __author__ = "tcoufal"
 
@@ -41,5 +41,79 @@ ATTACH_SKU_PATH = 'json/attach_sku.json'
 # Set retry limit
 RETRY = 5
 
-# Threads limit for fetching pool details
+# Backoff between retries (in seconds): the delay doubles with each attempt,
+# starting at BACKOFF_BASE up to BACKOFF_MAX, randomized (see budget.attempts)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+
+# Time budget (in seconds) of a single operation, shared by all its nested
+# calls and retries (see candlepin.budget)
+OPERATION_DEADLINE = 120
+
+# Threads limit for non-blocking operations (see candlepin.deferred), shared by
+# all requests in the process
+MAX_OPERATIONS = 20
+
+# Threads limit for calls fanned out by a single operation (eg. fetching pool
+# details), shared by all requests in the process (also the size of HTTP
+# connection pool kept alive for each host)
 MAX_THREADS = 50
+
+# Maximum number of Terms and Conditions accepted at once for one account
+TERMS_PARALLELISM = 5
+
+# Latency budget (seconds) for resolving pool quantities in View Account,
+# pools not resolved in time are listed with their raw quantity
+VIEW_DEADLINE = 15
+
+# Circuit breaker of each endpoint: consecutive failures opening the circuit
+# and seconds until a trial call is let through
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30
+
+# Adaptive limit of outbound calls running at once (between LIMITER_MIN and
+# MAX_THREADS), calls slower than LIMITER_LATENCY seconds lower it
+LIMITER_MIN = 4
+LIMITER_LATENCY = 5
+
+# Hedging of slow idempotent reads (see candlepin.hedging): enabled, maximum
+# share of hedged requests, number of recent latencies the delay (95th
+# percentile) is computed from and how many of them are needed at least
+HEDGING = False
+HEDGE_MAX_RATE = 0.05
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+# HTTP client settings: number of hosts to keep a connection pool for and
+# timeouts (in seconds) of a single call, shortened to the remaining budget
+POOL_CONNECTIONS = 10
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# SKU multipliers cache: maximum number of SKUs held and time to live (in
+# seconds). SKUs unknown to Candlepin are remembered for a shorter time.
+MULTIPLIER_CACHE_SIZE = 4096
+MULTIPLIER_CACHE_TTL = 3600
+MULTIPLIER_NEGATIVE_TTL = 300
+
+# Account identifiers cache (Org ID, user ID, customer IDs): maximum number of
+# accounts held and time to live (in seconds)
+IDENTITY_CACHE_SIZE = 1024
+IDENTITY_CACHE_TTL = 600
+
+# Verified credentials cache: maximum number of accounts held and time to live
+# (in seconds), the same applies to accounts without Terms accepted
+VERIFY_CACHE_SIZE = 1024
+VERIFY_CACHE_TTL = 60
+
+# UEPConnections kept for reuse: maximum number of idle connections and time
+# (in seconds) after which an idle connection is dropped
+CONNECTION_POOL_SIZE = 100
+CONNECTION_IDLE_TIMEOUT = 300
+
+# NOTE: Submodules are imported last, so they can use the settings above when
+# they are loaded
+import account
+import subscription
+import deferred
+from context import AccountContext
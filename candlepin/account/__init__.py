@@ -5,7 +5,7 @@ Contains base functionality to cover account creation and viewing of data
 """
 
 from create import create_new
-from view import get_details
+from view import get_details, iter_details
 from terms import accept_terms
 from subscribe import activate_pool
 from verify import verify
@@ -3,7 +3,10 @@ import requests
 import json
 
 import candlepin as env
+import candlepin.budget as budget
+import candlepin.client as client
 import candlepin.utils as utils
+from candlepin.context import AccountContext
 
 __author__ = "tcoufal"
 
@@ -17,12 +20,13 @@ def __check_existence(username):
     :param username: Username applicable to the desired account
     :return bool: True if user exists
     """
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         logging.debug("Checking if user is present in Candlepin")
         try:
-            r = requests.get("{0}/login={1}".format(env.REST_USER, username))
+            r = client.get("{0}/login={1}".format(env.REST_USER, username))
             r.raise_for_status()
-        except (requests.HTTPError, requests.ConnectionError) as e:
+        except (requests.HTTPError, requests.ConnectionError,
+                requests.Timeout) as e:
             logging.error('[New Account] failed to access the API: {0}, '
                           'retrying...'.format(e))
             continue
@@ -44,14 +48,15 @@ def __raw_create(user_data):
     :return bool: True if success
     """
     logging.debug("Creating user")
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            r = requests.post("{0}/create".format(env.REST_USER),
-                              headers={'content-type': 'application/json'},
-                              data=json.dumps(user_data))
+            r = client.post("{0}/create".format(env.REST_USER),
+                            headers={'content-type': 'application/json'},
+                            data=json.dumps(user_data))
             r.raise_for_status()
 
-        except (requests.HTTPError, requests.ConnectionError) as e:
+        except (requests.HTTPError, requests.ConnectionError,
+                requests.Timeout) as e:
             logging.error('[New Account] error when creating account: {0}, '
                           'retrying...'.format(e))
             continue
@@ -60,7 +65,7 @@ def __raw_create(user_data):
 
 
 def create_new(username, password, first_name=None,
-               last_name=None):
+               last_name=None, context=None):
     """
     Create new account for Stage Candlepin
 
@@ -71,6 +76,7 @@ def create_new(username, password, first_name=None,
     :param password: Account's password
     :param first_name: Account's first name
     :param last_name: Account's last name
+    :param context: Optional AccountContext, the new identifiers are stored
     :return org_id: User's Org ID is returned if the creation was successful
     """
     logging.debug("Initiated Account creation")
@@ -95,8 +101,10 @@ def create_new(username, password, first_name=None,
 
     # Verify
     logging.debug("Verifying user")
+    utils.invalidate_identity(username)
+    context = context or AccountContext(username, password)
     try:
-        org_id = utils.get_orgid(username)
+        org_id = context.org_id
     except NameError as e:
         logging.error('[New Account] failed to verify account: {0}'.format(e))
         raise RuntimeError('Unable to verify if account creation was '
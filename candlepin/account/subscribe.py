@@ -3,6 +3,8 @@ import requests
 import json
 
 import candlepin as env
+import candlepin.budget as budget
+import candlepin.client as client
 
 __author__ = "tcoufal"
 
@@ -31,16 +33,22 @@ def activate_pool(username, org_id, regnum, start_date):
         "systemName": "genie"
     }
 
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            r = requests.post('{0}/activate'.format(env.REST_ACTIVATION),
-                              headers={'content-type': 'application/json'},
-                              data=json.dumps(activation_info))
+            r = client.post('{0}/activate'.format(env.REST_ACTIVATION),
+                            headers={'content-type': 'application/json'},
+                            data=json.dumps(activation_info))
             r.raise_for_status()
         except (requests.ConnectionError, requests.HTTPError) as e:
+            # includes ConnectTimeout, the request was not sent
             logging.error("[Activate reg. number] Failed to active no. {0}:"
                           " {1}".format(regnum, e))
             continue
+        except requests.Timeout as e:
+            # the activation may still be processed, don't send it again
+            logging.error("[Activate reg. number] no response for no. {0}: "
+                          "{1}".format(regnum, e))
+            raise RuntimeError("Failed to active pool no. {0}".format(regnum))
 
         if "Reg number product not active for SKU" in r.content:
             logging.error("[Activate reg. number] Failed to active no. {0}"
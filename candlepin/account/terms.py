@@ -3,7 +3,11 @@ import logging
 import json
 
 import candlepin as env
+import candlepin.budget as budget
+import candlepin.client as client
 import candlepin.utils as utils
+import candlepin.executor as executor
+from candlepin.context import AccountContext
 
 __author__ = "tcoufal"
 
@@ -22,11 +26,12 @@ def __accept_term(term_id, user_id, customer_id):
     url = "{0}/ack/terms_id={1}/userid={2}/customerid={3}/type=ACCEPT"
     url = url.format(env.REST_TERMS, term_id, user_id, customer_id)
 
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            r = requests.put(url)
+            r = client.put(url)
             r.raise_for_status()
-        except (requests.ConnectionError, requests.HTTPError) as e:
+        except (requests.ConnectionError, requests.HTTPError,
+                requests.Timeout) as e:
             logging.error("[Accept Terms] failed to accept terms {0}: {1},"
                           " retrying...".format(term_id, e))
             continue
@@ -37,68 +42,62 @@ def __accept_term(term_id, user_id, customer_id):
     return False
 
 
-def __get_data(org_id):
+def __get_data(context):
     """
     Raw Terms and conditions identifiers retrieval
 
-    Based on the given 'org_id' the function queries the API and retrieves
-    every type of user ID needed for Terms accepting process and all the Terms
-    available as well.
-    :param org_id: Account's organization ID
+    Based on the given 'context' the function retrieves every type of user ID
+    needed for Terms accepting process (see AccountContext.identity()) and
+    queries the API for all the Terms available as well.
+    :param context: AccountContext of the account
     :return tuple: (<account Candlepin ID>,
                     <account Oracle ID>,
                     <customer ID from Oracle>,
                     <all Terms available in a dictinary>)
     """
-    for attempt in range(env.RETRY):
+    pool = executor.get_pool('calls', env.MAX_THREADS)
+    for attempt in budget.attempts():
         try:
-            # Get Oracle ID and User ID
-            r = requests.get("{0}/orgId={1}".format(env.REST_USER, org_id))
-            r.raise_for_status()
-            data = json.loads(r.content)[0]
-            user_id = data["id"]
-            oracle_id = data["customer"]["oracleCustomerNumber"]
-
-            # Get Customer ID
-            r = requests.get("{0}/customers/search".format(env.REST_USER),
-                             params={"oracleCustomerNumber": oracle_id,
-                                     "max": 10})
-            r.raise_for_status()
-            customer_id = json.loads(r.content)[0]["id"]
-
-            # Get all terms to sign
-            r = requests.get("{0}/status/userId={1}".format(env.REST_TERMS,
-                                                            user_id))
+            # Get User ID and Oracle ID first, then Customer ID and all terms
+            # to sign (these two are independent, fetch them at once)
+            identity = context.identity()
+            customer = pool.submit(context.identity, customer=True)
+            status = pool.submit(client.get, "{0}/status/userId={1}".format(
+                env.REST_TERMS, identity['user_id']))
+
+            identity = customer.result()
+            r = status.result()
             r.raise_for_status()
             terms = json.loads(r.content)
 
-        except (requests.ConnectionError, requests.HTTPError) as e:
+        except (requests.ConnectionError, requests.HTTPError,
+                requests.Timeout) as e:
             logging.error("[Accept Terms] account data query failed: {0}"
                           "".format(e))
             continue
-        return (user_id, oracle_id, customer_id, terms)
+        return (identity['user_id'], identity['oracle_id'],
+                identity['customer_id'], terms)
     return False
 
 
-def accept_terms(username, password, org_id=None):
+def accept_terms(username, password, org_id=None, context=None):
     """
     Accept Red Hat's Terms and Conditions and verify the result
 
-    Based on the given org_id (queried based on the username) for the account
-    the function initiates a Terms retrieval and then runs a request in order
-    to accept each of them. If it fails to accept the affected Terms are
-    collected and user is notified.
+    Based on the account's identifiers (queried based on the username) the
+    function initiates a Terms retrieval and then runs a request in order to
+    accept each of them (concurrently). If it fails to accept the affected
+    Terms are collected and user is notified.
     :param username: Account's username
     :param password: Account's password
-    :param org_id: Optionally caller can specify the Organization ID
+    :param org_id: Unused, kept for backward compatibility (identifiers are
+                   looked up by the username)
+    :param context: Optional AccountContext with the account's identifiers
     :return dict: {'succeed': <list of accepted Ts&Cs>,
                    'failed': <list of failed ones>}
     """
-    if not org_id:
-        org_id = utils.get_orgid(username)
-
     # Retrieve data
-    data = __get_data(org_id)
+    data = __get_data(context or AccountContext(username, password))
     if not data:
         logging.error('Unable to retrieve details about account {0}\'s terms '
                       'to sign.'.format(username))
@@ -111,14 +110,23 @@ def accept_terms(username, password, org_id=None):
                  "oracleCustomerNumber: '{2}', customer_id: {3}"
                  "".format(username, user_id, oracle_id, customer_id))
 
-    # Walk the terms and accept them
+    # Accept the terms, env.TERMS_PARALLELISM at once
+    pool = executor.get_pool('calls', env.MAX_THREADS)
+    term_ids = [term['id'] for term in terms["unacknowledged"]]
+    futures = pool.map(
+        lambda term_id: __accept_term(term_id, user_id, customer_id),
+        term_ids, limit=env.TERMS_PARALLELISM)
+
     result = {'succeed': [], 'failed': []}
-    for term in terms["unacknowledged"]:
-        if __accept_term(term['id'], user_id, customer_id):
-            result['succeed'].append(term['id'])
+    for term_id, future in zip(term_ids, futures):
+        if future.result():
+            result['succeed'].append(term_id)
         else:
-            result['failed'].append(term['id'])
+            result['failed'].append(term_id)
 
     if result['failed']:
         logging.debug("Some Terms failed to accept: {0}".format(result))
+    else:
+        # the account is active now
+        utils.INACTIVE.invalidate(utils.credentials_key(username, password))
     return result
@@ -3,12 +3,15 @@ import logging
 from rhsm import connection
 from M2Crypto.SSL import SSLError
 
-import candlepin as env
+import candlepin.budget as budget
+import candlepin.utils as utils
+import candlepin.singleflight as singleflight
+import candlepin.connections as connections
 
 __author__ = "tcoufal"
 
 
-def verify(username, password, ignore_inactive=True):
+def verify(username, password, ignore_inactive=True, context=None):
     """
     Verify the credentials for the account
 
@@ -16,16 +19,49 @@ def verify(username, password, ignore_inactive=True):
     Candlepin. Also provides a verification if the account is active (if it has
     all the "Terms and Conditions" accepted). In case of inactive account
     activation is requested.
+
+    Successful verifications (and accounts without Terms accepted) are cached
+    for a short time, see utils.VERIFIED and utils.INACTIVE. Concurrent
+    verifications of the same credentials share one query.
     :param username: Account's username
     :param password: Account's password
+    :param context: Optional AccountContext, the owner is stored there
+    """
+    key = utils.credentials_key(username, password)
+    if utils.VERIFIED.get(key):
+        logging.debug("[Verify Account] credentials verified recently")
+        return True
+    elif utils.INACTIVE.get(key):
+        logging.warning("[Verify Account] Terms have not been accepted yet.")
+        if ignore_inactive:
+            return True
+        raise RuntimeError("Account is not active")
+
+    owner = singleflight.do('verify', (key, ignore_inactive), __verify,
+                            username, password, ignore_inactive)
+    if context is not None and owner is not None:
+        context.owner = owner
+    return True
+
+
+def __verify(username, password, ignore_inactive):
     """
-    for attempt in range(env.RETRY):
+    Verify the credentials in Candlepin, see verify()
+    :param username: Account's username
+    :param password: Account's password
+    :param ignore_inactive: Treat accounts without Terms accepted as valid
+    :return dict: Account's owner (None if it's not known)
+    """
+    key = utils.credentials_key(username, password)
+    owner = None
+    inactive = False
+    for attempt in budget.attempts():
         try:
-            con = connection.UEPConnection(env.STAGE_CANDLEPIN,
-                                           username=username,
-                                           password=password)
-            # Perform a request to server
-            con.getOwnerList(con.username)
+            with connections.POOL.connection(username, password) as con:
+                # Perform a request to server
+                owners = con.getOwnerList(con.username)
+                if owners:
+                    owner = owners[0]
 
         except connection.RestlibException as e:
             # the only way how to differentiate the error reason is to match
@@ -33,6 +69,8 @@ def verify(username, password, ignore_inactive=True):
             if "You must first accept" in e.msg:
                 logging.warning("[Verify Account] Terms have not been accepted"
                                 " yet.")
+                utils.INACTIVE.set(key, True)
+                inactive = True
                 # if ignore_inactive is set, treat the credentials as valid
                 if ignore_inactive:
                     break
@@ -64,4 +102,7 @@ def verify(username, password, ignore_inactive=True):
         logging.error("[Account Info] out of retries")
         raise ValueError("Unable to verify credentials for account '{0}'"
                          "".format(username))
-    return True
+
+    if not inactive:
+        utils.VERIFIED.set(key, True)
+    return owner
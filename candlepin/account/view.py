@@ -1,17 +1,20 @@
 import logging
-from Queue import Queue
-from threading import Thread
 
 from rhsm import connection
 from M2Crypto.SSL import SSLError
 
 import candlepin as env
+import candlepin.budget as budget
 import candlepin.utils as utils
+import candlepin.executor as executor
+import candlepin.singleflight as singleflight
+import candlepin.connections as connections
+from candlepin.context import AccountContext
 
 __author__ = "tcoufal"
 
 
-def __raw_get_data(username, password):
+def __raw_get_data(username, password, owner=None):
     """
     A Data retrieval procedure for given user account
 
@@ -20,18 +23,16 @@ def __raw_get_data(username, password):
     whether the account is active or not.
     :param username: Account's username
     :param password: Account's password
+    :param owner: Account's owner if it's known already
     :return dict: {'owner' : <dict containing account details>,
                    'pool': <a list of pools attached>}
     """
     logging.debug('[Account Info] fetching account info')
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            con = connection.UEPConnection(env.STAGE_CANDLEPIN,
-                                           username=username,
-                                           password=password)
-
-            owner_dict = con.getOwnerList(con.username)[0]
-            pool_list = con.getPoolsList(owner=owner_dict['key'])
+            with connections.POOL.connection(username, password) as con:
+                owner_dict = owner or con.getOwnerList(con.username)[0]
+                pool_list = con.getPoolsList(owner=owner_dict['key'])
 
         except connection.RestlibException as e:
             # the only way how to differentiate the error reason is to match
@@ -68,117 +69,202 @@ def __raw_get_data(username, password):
         raise ValueError("Unable to verify credentials for account '{0}'"
                          "".format(username))
 
+    # credentials are valid, no need to verify them again for a while
+    utils.VERIFIED.set(utils.credentials_key(username, password), True)
+
     # if when everything is fine and 'break' invoked, return result
     return {'pools': pool_list, 'owner': owner_dict}
 
 
-def pool_worker(queue, username, password, lst):
+def __fetch_multiplier(username, password, sku):
+    """
+    Fetch multipliers for the SKU
+
+    SKUs unknown to Candlepin have no multipliers. Any other failure is raised,
+    the pool's quantity can't be computed then.
+    :param username: Account's usermane
+    :param password: Account's password
+    :param sku: SKU to look up
+    :return tuple: (<multiplier>, <instance multiplier>)
     """
-    Fetch and filter the data for each pool
+    try:
+        return utils.get_multiplier(username, password, sku)
+    except NameError:
+        # no multipliers, leave the quantity as it is
+        return (1, 1)
 
-    For each item available in the 'queue' determine which information is
-    needed and try to fetch the quantity if necessary.
+
+def __parse_pool(pool, multipliers, error=None):
+    """
+    Filter the data for given pool
 
     Pool data the tool is interested in are:
     {'id': <subscription pool ID>,
      'sku': <SKU identifier>,
      'name': <SKU name for easier identification>,
      'quantity': <pool quantity corrected by multipliers>}
-
-    Only pools marked as 'NORMAL' matters.
-    :param queue: A Queue instance containing pools from Candlepin
-    :param username: Account's usermane
-    :param password: Account's password
-    :param lst: a dict where the result is appended
+    Pools without multipliers resolved are marked, their quantity is raw:
+    {'raw': True, 'error': <reason why the multipliers are missing>}
+    :param pool: Pool data from Candlepin
+    :param multipliers: a dict of multipliers for each SKU
+    :param error: Reason why the multipliers for the pool are missing
+    :return dict: Pool data
     """
-    while True:
-        # In case of empty queue, break and exit
-        if queue.empty():
-            break
-        pool = queue.get()
-        logging.debug("[Account Info] pool worker - parsing '{0}' pool's data"
-                      "".format(pool['id']))
-
-        # Skip if not 'NORMAL'
-        if pool['type'].lower() != 'normal':
-            queue.task_done()
-            continue
+    pool_data = {
+        'id': pool['id'],
+        'sku': pool['productId'],
+        'name': pool['productName']
+    }
+
+    # Compute quantity
+    if pool['quantity'] is -1:
+        pool_data['quantity'] = 'unlimited'
+    elif error is not None:
+        pool_data.update({'quantity': pool['quantity'], 'raw': True,
+                          'error': error})
+    else:
+        multiplier, instance_multiplier = multipliers[pool['productId']]
+        pool_data['quantity'] = \
+            pool['quantity'] / multiplier / instance_multiplier
+    return pool_data
+
 
-        # General info
-        pool_data = {
-            'id': pool['id'],
-            'sku': pool['productId'],
-            'name': pool['productName']
-        }
-
-        # Compute quantity
-        if pool['quantity'] is -1:
-            pool_data['quantity'] = 'unlimited'
-        else:
-            multipliers = [1,1]
-            try:
-                multipliers = utils.get_multiplier(username, password,
-                                                   pool['productId'])
-            except NameError:
-                # failed to get multipliers
-                # NOTE: just task_done? Wouldn't be an exception better?
-                queue.task_done()
-
-            pool_data['quantity'] = \
-                    pool['quantity'] / multipliers[0] / multipliers[1]
-
-        lst.append(pool_data)
-        queue.task_done()
-
-
-def get_details(username, password):
+def iter_details(username, password, resolver=None, context=None,
+                 pool_type='normal', sku_prefix=None, offset=0, limit=None,
+                 deadline=env.VIEW_DEADLINE):
     """
-    Query the Candlepin for information about given account.
+    Query the Candlepin for information about given account, pool by pool
 
-    Retrieve account's details, parse them and form a dictionary containing the
-    important data (general info and subscription pools as well).
+    Same as get_details(), but the pools are filtered, sorted and paginated
+    first. Then they are generated one by one as soon as their quantity is
+    resolved, so the whole result is never held in memory. Quantities not
+    resolved within the deadline are listed raw (see __parse_pool()).
+    Concurrent calls for the same account share one pool list query.
     :param username: Account's username
     :param password: Account's password
-    :return dict: Structured data with account details and attached
-                  subscriptions
+    :param resolver: See get_details()
+    :param context: Optional AccountContext, its owner is used (and stored)
+    :param pool_type: Only pools of this type are listed ('normal' by default,
+                      None for all)
+    :param sku_prefix: Only pools of SKUs starting with the prefix are listed
+    :param offset: Number of (sorted) pools to skip
+    :param limit: Maximum number of pools to list
+    :param deadline: Seconds to spend on resolving the quantities at most,
+                     counted from the start of the call (None for no limit),
+                     never more than the operation's budget
+    :return tuple: ({'username': <username>, 'org_id': <org ID>,
+                     'total': <number of pools matching the filters>},
+                    <generator of pool dicts, see __parse_pool()>)
     """
+    expires = budget.Deadline(deadline)
     # Get data
-    raw_data = __raw_get_data(username, password)
+    owner = context.owner if context is not None else None
+    raw_data = singleflight.do(
+        'pools', utils.credentials_key(username, password), __raw_get_data,
+        username, password, owner=owner)
+    if context is not None:
+        context.owner = raw_data['owner']
     # Process retrieved data
     logging.debug('[Account Info] parsing account info')
     # General account information
-    data = {'username': username, 'org_id': raw_data['owner']['key']}
+    info = {'username': username, 'org_id': raw_data['owner']['key']}
+
+    # Keep only pools matching the filters, drop the rest of the data
+    def match(pool):
+        if pool_type and pool['type'].lower() != pool_type.lower():
+            return False
+        return not sku_prefix or \
+            pool['productId'].upper().startswith(sku_prefix.upper())
+
+    pools = [p for p in raw_data['pools'] if match(p)]
+    raw_count = len(raw_data['pools'])
+    del raw_data
+
+    pools.sort(key=lambda item: item['id'])
+    info['total'] = len(pools)
+    pools = pools[offset:None if limit is None else offset + limit]
+
+    # Each SKU is looked up just once, even if more pools share it
+    skus = set(p['productId'] for p in pools if p['quantity'] != -1)
+
+    multipliers = dict()
+    if skus and resolver:
+        multipliers.update(resolver(skus))
+
+    # Query Candlepin only for the rest, use the shared worker pool
+    missing = list(skus.difference(multipliers))
+    executor_pool = executor.get_pool('calls', env.MAX_THREADS)
+    futures = dict(zip(missing, executor_pool.map(
+        lambda sku: __fetch_multiplier(username, password, sku), missing)))
+
+    logging.debug("[Account Info] found {0} pools ({2} skipped, {3} listed, "
+                  "{4} of {5} SKUs looked up in Candlepin) for '{1}' account"
+                  "".format(info['total'], username, raw_count - info['total'],
+                            len(pools), len(missing), len(skus)))
+
+    errors = dict()
+
+    def generate():
+        for pool in pools:
+            sku = pool['productId']
+            if sku in futures:
+                # Block until the multipliers are retrieved or time is up
+                future = futures.pop(sku)
+                try:
+                    multipliers[sku] = future.result(expires.remaining())
+                except Exception as e:
+                    # an unfinished lookup keeps running, its result gets
+                    # cached for the next time
+                    errors[sku] = str(e) if future.done() else \
+                        "Deadline exceeded"
+                if sku in errors:
+                    logging.warning("[Account Info] quantity of '{0}' left "
+                                    "raw: {1}".format(sku, errors[sku]))
+            yield __parse_pool(pool, multipliers, errors.get(sku))
+
+    return info, generate()
+
+
+def get_details(username, password, resolver=None, context=None,
+                deadline=env.VIEW_DEADLINE):
+    """
+    Query the Candlepin for information about given account.
 
-    # If pools are present, process each of them
-    if not raw_data['pools']:
-        logging.debug("[Account Info] no pools present for '{0}' account".format(username))
-        data['pools'] = list()
-        return data
+    Retrieve account's details, parse them and form a dictionary containing the
+    important data (general info and subscription pools as well).
 
-    pools = list()
+    Multipliers are taken from the 'resolver' first (eg. a local SKU database),
+    only SKUs it doesn't know are queried in Candlepin.
+    :param username: Account's username
+    :param password: Account's password
+    :param resolver: Optional callable, takes a set of SKUs and returns
+                     {<sku>: (<multiplier>, <instance multiplier>)} for the
+                     SKUs it knows
+    :param context: Optional AccountContext, its owner is used (and stored)
+    :param deadline: See iter_details()
+    :return dict: Structured data with account details and attached
+                  subscriptions, 'partial' is set when some quantities are raw
+    """
+    # concurrent identical calls share the whole result
+    owner = context.owner if context is not None else None
+    key = (utils.credentials_key(username, password), resolver, deadline)
+    details, owner = singleflight.do('details', key, __get_details, username,
+                                     password, resolver, deadline, owner)
+    if context is not None:
+        context.owner = owner
+    return dict(details)
 
-    # Initialize the pools queue
-    queue = Queue()
-    [queue.put(item) for item in raw_data['pools']]
 
-    # Initialize workers
-    threads = list()
-    if len(raw_data['pools']) > env.MAX_THREADS:
-        max_threads = env.MAX_THREADS
-    else:
-        max_threads = len(raw_data['pools'])
-
-    for i in range(max_threads):
-        t = Thread(target=pool_worker, args=(queue, username, password, pools))
-        t.setDaemon(True)
-        t.start()
-        threads.append(t)
-
-    # Block until the data are retrieved, then stop the workers
-    queue.join()
-
-    data['pools'] = sorted(pools, key=lambda item: item['id'])
-    logging.debug("[Account Info] found and parsed {0} pools ({2} skipped) for '{1}' account"
-                  "".format(len(data['pools']), username,
-                            len(raw_data['pools']) - len(data['pools'])))
-    return data
+def __get_details(username, password, resolver, deadline, owner):
+    """
+    Get account details, see get_details()
+    :return tuple: (<account details>, <account's owner>)
+    """
+    context = AccountContext(username, password)
+    context.owner = owner
+    info, pools = iter_details(username, password, resolver=resolver,
+                               context=context, deadline=deadline)
+    pools = list(pools)
+    return ({'username': info['username'], 'org_id': info['org_id'],
+             'pools': pools, 'partial': any(p.get('raw') for p in pools)},
+            context.owner)
@@ -0,0 +1,266 @@
+"""
+Protection of the upstream services (Stage Candlepin and its REST APIs)
+
+Every outbound call passes through guard():
+- a circuit breaker per endpoint stops sending calls to an endpoint which
+  keeps failing and lets a single trial call through once in a while,
+- an adaptive limiter caps the number of calls running in parallel across all
+  requests in the process. The cap grows slowly while calls succeed in time and
+  halves on errors or slow responses (AIMD).
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urlparse import urlparse
+
+import candlepin as env
+import candlepin.budget as budget
+
+__author__ = "tcoufal"
+
+# Registry of circuit breakers, one per endpoint
+BREAKERS = dict()
+_lock = threading.Lock()
+
+
+class ServiceUnavailable(RuntimeError):
+    """
+    Raised instead of calling an endpoint which can't take the call now
+    """
+    pass
+
+
+class CircuitOpenError(ServiceUnavailable):
+    """
+    Raised instead of calling an endpoint whose circuit is open
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of a single endpoint
+
+    closed:    calls pass, consecutive failures are counted
+    open:      calls fail fast, entered after too many consecutive failures
+    half-open: after a while a single trial call is let through, its result
+               closes or opens the circuit again
+    """
+
+    def __init__(self, name, failures, reset):
+        """
+        :param name: Endpoint identifier
+        :param failures: Consecutive failures opening the circuit
+        :param reset: Seconds the circuit stays open before a trial call
+        """
+        self.name = name
+        self.threshold = failures
+        self.reset = reset
+        self.state = 'closed'
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        """
+        Ask for permission to call the endpoint
+        :raise CircuitOpenError: When the call should not be made
+        """
+        with self._lock:
+            if self.state == 'open' and \
+                    time.time() - self._opened_at >= self.reset:
+                self.state = 'half-open'
+            if self.state == 'closed' or \
+                    (self.state == 'half-open' and not self._trial):
+                self._trial = self.state == 'half-open'
+                return
+            self.rejected += 1
+        raise CircuitOpenError("Service '{0}' is unavailable, try again later"
+                               "".format(self.name))
+
+    def success(self):
+        """
+        Record a successful call
+        """
+        with self._lock:
+            if self.state != 'closed':
+                logging.info("[Breaker] '{0}' closed".format(self.name))
+            self.state = 'closed'
+            self.failures = 0
+            self._trial = False
+
+    def failure(self):
+        """
+        Record a failed call
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half-open' or (self.state == 'closed' and
+                                             self.failures >= self.threshold):
+                logging.warning("[Breaker] '{0}' opened after {1} failures"
+                                "".format(self.name, self.failures))
+                self.state = 'open'
+                self.opened += 1
+                self._opened_at = time.time()
+            self._trial = False
+
+    def cancel(self):
+        """
+        Record a call which was permitted but not made
+        """
+        with self._lock:
+            self._trial = False
+
+    def stats(self):
+        """
+        Breaker statistics
+        :return dict: {'state', 'failures', 'opened', 'rejected'}
+        """
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures,
+                    'opened': self.opened, 'rejected': self.rejected}
+
+
+class AdaptiveLimiter(object):
+    """
+    Limit of outbound calls running at once, adjusted by AIMD
+
+    Each call succeeding within the latency target raises the limit by
+    1/<limit> (ie. by one per a full window of calls), a failed or slow call
+    (unless its duration is not bounded, see release()) halves it (at most
+    once per the latency target, so a burst of failures counts once). The
+    limit stays within <minimum, maximum>.
+    """
+
+    def __init__(self, minimum, maximum, latency):
+        """
+        :param minimum: Lowest limit
+        :param maximum: Highest limit (also the initial one)
+        :param latency: Seconds, a slower call is considered a congestion
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency = latency
+        self.limit = float(maximum)
+        self.running = 0
+        self.decreased = 0
+        self._decreased_at = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a free slot
+        :param timeout: Seconds to wait at most (wait forever by default)
+        :return bool: True if the slot was acquired
+        """
+        expires = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self.running >= int(self.limit):
+                if expires is None:
+                    self._cond.wait()
+                elif time.time() >= expires:
+                    return False
+                else:
+                    self._cond.wait(expires - time.time())
+            self.running += 1
+            return True
+
+    def release(self, ok, elapsed, timed=True):
+        """
+        Free the slot and adjust the limit
+        :param ok: Whether the call succeeded
+        :param elapsed: Seconds the call took
+        :param timed: Whether a slow call counts as a congestion (False for
+                      calls whose duration depends on the amount of data)
+        """
+        with self._cond:
+            self.running -= 1
+            if ok and (not timed or elapsed <= self.latency):
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif time.time() - self._decreased_at >= self.latency:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreased += 1
+                self._decreased_at = time.time()
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Limiter statistics
+        :return dict: {'limit', 'running', 'decreased'}
+        """
+        with self._cond:
+            return {'limit': int(self.limit), 'running': self.running,
+                    'decreased': self.decreased}
+
+
+# Calls limit shared by all requests in the process
+LIMITER = AdaptiveLimiter(env.LIMITER_MIN, env.MAX_THREADS,
+                          env.LIMITER_LATENCY)
+
+
+def endpoint(url):
+    """
+    Endpoint identifier of the URL: host and the first two path segments
+    (eg. 'subscription.rhsm.stage.redhat.com/subscription/products')
+    :param url: URL or a host name
+    :return str: The identifier
+    """
+    parsed = urlparse(url if '//' in url else '//' + url)
+    path = [s for s in parsed.path.split('/') if s][:2]
+    return '/'.join([parsed.netloc] + path)
+
+
+def get_breaker(name):
+    """
+    Get the circuit breaker of the endpoint, create it on the first call
+    :param name: Endpoint identifier
+    :return CircuitBreaker: The breaker instance
+    """
+    with _lock:
+        if name not in BREAKERS:
+            BREAKERS[name] = CircuitBreaker(name, env.BREAKER_FAILURES,
+                                            env.BREAKER_RESET)
+        return BREAKERS[name]
+
+
+@contextmanager
+def guard(url, is_failure=lambda e: True, timed=True):
+    """
+    Run an outbound call to the URL under the breaker and the limiter
+
+    Any exception raised by the block counts as a failure, unless 'is_failure'
+    says otherwise. The block can report a failure without raising by setting
+    call['failed'] (eg. on a 5xx response).
+    :param url: URL (or host) of the call
+    :param is_failure: Callable deciding whether an exception is a failure of
+                       the service
+    :param timed: Whether the call is expected to finish within the limiter's
+                  latency target, see AdaptiveLimiter.release()
+    :raise CircuitOpenError: When the endpoint's circuit is open
+    :raise ServiceUnavailable: When no call slot frees up within the budget
+    """
+    breaker = get_breaker(endpoint(url))
+    breaker.before()
+    if not LIMITER.acquire(budget.remaining()):
+        breaker.cancel()
+        raise ServiceUnavailable("Too many calls to '{0}' in progress, try "
+                                 "again later".format(breaker.name))
+
+    call = {'failed': False}
+    start = time.time()
+    try:
+        yield call
+    except Exception as e:
+        call['failed'] = is_failure(e)
+        raise
+    finally:
+        LIMITER.release(not call['failed'], time.time() - start, timed)
+        if call['failed']:
+            breaker.failure()
+        else:
+            breaker.success()
@@ -0,0 +1,145 @@
+"""
+Time budget of operations
+
+An operation (eg. a single request to Ethel) runs within a deadline. The
+deadline is kept per thread and passed to the tasks the operation submits to
+the worker pools (see candlepin.executor), so every nested call and retry
+shares the same budget:
+
+    with budget.limit(env.OPERATION_DEADLINE):
+        candlepin.account.get_details(username, password)
+
+HTTP calls shorten their timeouts to the remaining budget (see
+candlepin.client) and retry loops back off between attempts only as long as
+the budget allows (see attempts()).
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import candlepin as env
+
+__author__ = "tcoufal"
+
+_local = threading.local()
+
+
+class Deadline(object):
+    """
+    Point in time an operation has to be finished by
+
+    A deadline can't outlive the deadline of the operation it's created in,
+    nested budgets can only shorten it.
+    """
+
+    def __init__(self, seconds=None):
+        """
+        :param seconds: Time budget (no limit by default)
+        """
+        self.expires = None if seconds is None else time.time() + seconds
+        parent = current()
+        if parent is not None and parent.expires is not None and \
+                (self.expires is None or parent.expires < self.expires):
+            self.expires = parent.expires
+
+    def remaining(self):
+        """
+        :return float: Seconds left (None if there is no limit)
+        """
+        if self.expires is None:
+            return None
+        return max(self.expires - time.time(), 0)
+
+    def expired(self):
+        """
+        :return bool: True if there is no time left
+        """
+        return self.expires is not None and time.time() >= self.expires
+
+
+def current():
+    """
+    :return Deadline: Deadline of the operation running in this thread or None
+    """
+    return getattr(_local, 'deadline', None)
+
+
+def remaining():
+    """
+    :return float: Seconds left for the running operation (None if unlimited)
+    """
+    deadline = current()
+    return None if deadline is None else deadline.remaining()
+
+
+def expired():
+    """
+    :return bool: True if the running operation is out of time
+    """
+    deadline = current()
+    return deadline is not None and deadline.expired()
+
+
+@contextmanager
+def activate(deadline):
+    """
+    Run the block within the deadline (eg. a deadline of another thread)
+    :param deadline: Deadline instance or None for no limit
+    """
+    previous = current()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def limit(seconds):
+    """
+    Run the block within a time budget, see Deadline
+    :param seconds: Time budget
+    """
+    return activate(Deadline(seconds))
+
+
+def timeout():
+    """
+    Timeouts for a single HTTP call, shortened to the remaining budget
+    :return tuple: (<connect timeout>, <read timeout>)
+    """
+    left = remaining()
+    if left is None:
+        return env.CONNECT_TIMEOUT, env.READ_TIMEOUT
+    return min(env.CONNECT_TIMEOUT, left), min(env.READ_TIMEOUT, left)
+
+
+def attempts(retries=None):
+    """
+    Attempts of a retry loop
+
+    Drop-in replacement of 'range(env.RETRY)'. Before each retry it sleeps for
+    an exponentially growing, randomized (full jitter) delay. The loop ends
+    early when the remaining budget can't cover the delay, so the caller's
+    'out of retries' handling applies.
+    :param retries: Maximum number of attempts (env.RETRY by default)
+    :return generator: Attempt numbers
+    """
+    retries = env.RETRY if retries is None else retries
+    for attempt in range(retries):
+        if attempt:
+            backoff = env.BACKOFF_BASE * 2 ** (attempt - 1)
+            delay = random.uniform(0, min(env.BACKOFF_MAX, backoff))
+            left = remaining()
+            if left is not None and delay >= left:
+                logging.warning("[Budget] no time left for attempt {0}"
+                                "".format(attempt + 1))
+                return
+            time.sleep(delay)
+        elif expired():
+            logging.warning("[Budget] deadline exceeded before the first "
+                            "attempt")
+            return
+        yield attempt
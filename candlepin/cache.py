@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+__author__ = "tcoufal"
+
+# Registry of all caches in the package, used for statistics
+CACHES = dict()
+
+# Value stored for keys known to be missing (negative caching)
+NOT_FOUND = object()
+
+
+class TTLCache(object):
+    """
+    Bounded, thread-safe LRU cache with expiring entries
+
+    When the cache is full the least recently used entry is dropped. Each
+    entry expires after 'ttl' seconds (can be overridden per entry). Hits and
+    misses are counted so the cache efficiency can be monitored.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        """
+        :param name: Cache identifier used in statistics
+        :param maxsize: Maximum number of entries
+        :param ttl: Default time to live of an entry in seconds
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        """
+        Look up a value, expired entries are treated as missing
+        :param key: Entry key
+        :param default: Returned when the key is not cached
+        :return: Cached value or 'default'
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires < time.time():
+                self.misses += 1
+                return default
+
+            # re-insert to mark the entry as the most recently used
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value
+        :param key: Entry key
+        :param value: Value to store
+        :param ttl: Optional time to live overriding the default one
+        """
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Drop an entry from the cache (if present)
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drop all entries and reset counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Cache statistics
+        :return dict: {'size', 'maxsize', 'hits', 'misses', 'hit_ratio'}
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / total if total else 0.0
+            }
+
+
+def stats():
+    """
+    Statistics of all caches in the package
+    :return dict: {<cache name>: <cache statistics>}
+    """
+    return {name: c.stats() for name, c in CACHES.items()}
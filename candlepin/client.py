@@ -0,0 +1,92 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import candlepin as env
+import candlepin.breaker as breaker
+import candlepin.budget as budget
+
+__author__ = "tcoufal"
+
+# Shared session, created lazily so the settings in the 'candlepin' package
+# can be adjusted before the first request is made
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Shared HTTP session used by every request in the package
+
+    The session keeps alive connections in per-host pools, so consecutive
+    calls against the same API skip the TCP (and TLS) handshake. The pool size
+    matches env.MAX_THREADS, so each pool worker can hold its own connection.
+    :return requests.Session: the session instance
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                adapter = HTTPAdapter(pool_connections=env.POOL_CONNECTIONS,
+                                      pool_maxsize=env.MAX_THREADS)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def close():
+    """
+    Close all pooled connections, a new session is created on the next call
+    """
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def request(method, url, **kwargs):
+    """
+    Perform a request via the shared session
+
+    Connect and read timeouts from the package settings (shortened to the
+    remaining budget of the operation) are applied unless the caller specifies
+    its own. No request is sent once the budget is exhausted or while the
+    endpoint's circuit is open (see candlepin.breaker).
+    :param method: HTTP method
+    :param url: URL of the request
+    :param kwargs: any other arguments accepted by requests
+    :return requests.Response: the response
+    """
+    if budget.expired():
+        raise requests.Timeout("Deadline exceeded, {0} {1} not sent"
+                               "".format(method, url))
+    with breaker.guard(url) as call:
+        kwargs.setdefault('timeout', budget.timeout())
+        r = get_session().request(method, url, **kwargs)
+        call['failed'] = r.status_code >= 500
+    return r
+
+
+def get(url, **kwargs):
+    """
+    Send a GET request via the shared session
+    """
+    return request('GET', url, **kwargs)
+
+
+def put(url, **kwargs):
+    """
+    Send a PUT request via the shared session
+    """
+    return request('PUT', url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    Send a POST request via the shared session
+    """
+    return request('POST', url, **kwargs)
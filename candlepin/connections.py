@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from rhsm import connection
+from M2Crypto.SSL import SSLError
+
+import candlepin as env
+import candlepin.breaker as breaker
+import candlepin.utils as utils
+
+__author__ = "tcoufal"
+
+
+def _is_failure(e):
+    """
+    Decide whether an exception means Stage Candlepin is failing (as opposed
+    to eg. wrong credentials)
+    :param e: The exception
+    :return bool: True for network errors and server side errors
+    """
+    if isinstance(e, connection.RestlibException):
+        return e.code >= 500
+    return isinstance(e, (SSLError, connection.ConnectionException))
+
+
+class UEPConnectionPool(object):
+    """
+    Bounded pool of ready-made UEPConnections keyed by credentials
+
+    Building a UEPConnection (SSL context, authentication setup) is expensive,
+    so idle connections are kept for reuse by subsequent requests for the same
+    account. Connections idle for too long are evicted, a connection which
+    failed during its use is never returned to the pool.
+    """
+
+    def __init__(self, maxsize, idle_timeout):
+        """
+        :param maxsize: Maximum number of idle connections kept in total
+        :param idle_timeout: Seconds after which an idle connection is evicted
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.created = 0
+        self.reused = 0
+        # {(<credentials key>, <connection id>): (<last used>, <connection>)}
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        """
+        Drop expired connections and the oldest ones over the limit (called
+        with the lock held)
+        """
+        now = time.time()
+        for k, (used, con) in self._idle.items():
+            if now - used > self.idle_timeout or \
+                    len(self._idle) > self.maxsize:
+                del self._idle[k]
+
+    def acquire(self, username, password):
+        """
+        Get an idle connection for the account or create a new one
+        :param username: Account's username
+        :param password: Account's password
+        :return UEPConnection: The connection
+        """
+        key = utils.credentials_key(username, password)
+        with self._lock:
+            self._evict()
+            for k in reversed(self._idle.keys()):
+                if k[0] == key:
+                    used, con = self._idle.pop(k)
+                    self.reused += 1
+                    return con
+            self.created += 1
+
+        logging.debug("[Connection] creating UEPConnection for '{0}'"
+                      "".format(username))
+        return connection.UEPConnection(env.STAGE_CANDLEPIN,
+                                        username=username, password=password)
+
+    def release(self, username, password, con):
+        """
+        Return a healthy connection to the pool
+        :param username: Account's username
+        :param password: Account's password
+        :param con: The connection
+        """
+        key = utils.credentials_key(username, password)
+        with self._lock:
+            self._idle[(key, id(con))] = (time.time(), con)
+            self._evict()
+
+    @contextmanager
+    def connection(self, username, password):
+        """
+        Borrow a connection for the account
+
+        The connection is returned to the pool when the block finishes, in case
+        of any exception it is dropped. The block runs under Stage Candlepin's
+        circuit breaker and the calls limiter (see candlepin.breaker).
+        :param username: Account's username
+        :param password: Account's password
+        """
+        # the block may list thousands of pools, so only failures (not slow
+        # calls) lower the limit
+        with breaker.guard(env.STAGE_CANDLEPIN, is_failure=_is_failure,
+                           timed=False):
+            con = self.acquire(username, password)
+            yield con
+        self.release(username, password, con)
+
+    def stats(self):
+        """
+        Pool statistics
+        :return dict: {'idle', 'maxsize', 'created', 'reused'}
+        """
+        with self._lock:
+            return {'idle': len(self._idle), 'maxsize': self.maxsize,
+                    'created': self.created, 'reused': self.reused}
+
+
+# Connections shared by all requests in the process
+POOL = UEPConnectionPool(env.CONNECTION_POOL_SIZE,
+                         env.CONNECTION_IDLE_TIMEOUT)
@@ -0,0 +1,70 @@
+import threading
+
+import candlepin.utils as utils
+
+__author__ = "tcoufal"
+
+
+class AccountContext(object):
+    """
+    Facts about an account gathered during a single request
+
+    Every fact is fetched lazily on its first use and remembered, so each of
+    them is queried at most once per request. Functions of the package accept
+    the context and fill in what they learn along the way (eg. verify() stores
+    the owner, which also carries the Org ID).
+    """
+
+    def __init__(self, username, password=None):
+        """
+        :param username: Account's username
+        :param password: Account's password
+        """
+        self.username = username
+        self.password = password
+        self.owner = None
+        self._identity = None
+        self._lock = threading.Lock()
+
+    def identity(self, customer=False):
+        """
+        Account's identifiers, see utils.get_identity()
+        :param customer: Fetch the customer ID as well
+        :return dict: The identifiers
+        """
+        with self._lock:
+            if self._identity is None or \
+                    (customer and self._identity['customer_id'] is None):
+                self._identity = utils.get_identity(self.username,
+                                                    customer=customer)
+            return self._identity
+
+    @property
+    def org_id(self):
+        """
+        Account's Org ID, taken from the owner if it's known already
+        """
+        if self.owner is not None:
+            return str(self.owner['key'])
+        return self.identity()['org_id']
+
+    @property
+    def user_id(self):
+        """
+        Account's Candlepin ID
+        """
+        return self.identity()['user_id']
+
+    @property
+    def oracle_id(self):
+        """
+        Account's Oracle customer number
+        """
+        return self.identity()['oracle_id']
+
+    @property
+    def customer_id(self):
+        """
+        Customer ID from Oracle
+        """
+        return self.identity(customer=True)['customer_id']
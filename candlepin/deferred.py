@@ -0,0 +1,43 @@
+"""
+Non-blocking counterparts of the package's API
+
+Each function takes the same arguments as its blocking counterpart, schedules
+the call on a shared worker pool and returns a Future immediately. Retries and
+errors are exactly the same as in the blocking calls; exceptions are re-raised
+by Future.result(). This allows the caller to fan out operations for many
+accounts at once:
+
+    futures = [deferred.get_details(u, p) for u, p in accounts]
+    done, pending = executor.wait(futures, timeout=60)
+"""
+
+from functools import wraps
+
+import candlepin as env
+import candlepin.executor as executor
+from candlepin import account, subscription
+
+__author__ = "tcoufal"
+
+
+def __deferred(func):
+    """
+    Wrap a blocking function so it's executed in the 'operations' pool
+    :param func: The blocking function
+    :return: A function returning a Future
+    """
+    @wraps(func)
+    def submit(*args, **kwargs):
+        pool = executor.get_pool('operations', env.MAX_OPERATIONS)
+        return pool.submit(func, *args, **kwargs)
+    return submit
+
+
+create_new = __deferred(account.create_new)
+verify = __deferred(account.verify)
+get_details = __deferred(account.get_details)
+accept_terms = __deferred(account.accept_terms)
+activate_pool = __deferred(account.activate_pool)
+create_pool = __deferred(subscription.create_pool)
+create_pools = __deferred(subscription.create_pools)
+refresh_pools = __deferred(subscription.refresh_pools)
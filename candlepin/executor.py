@@ -0,0 +1,278 @@
+import atexit
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+import candlepin.budget as budget
+
+__author__ = "tcoufal"
+
+# Registry of all worker pools in the process
+# NOTE: 'operations' pool runs whole operations (see candlepin.deferred),
+# 'calls' pool runs single calls fanned out by them, 'hedges' pool runs single
+# HTTP requests (see candlepin.hedging). Tasks in 'calls' may wait for 'hedges'
+# only, tasks in 'hedges' must never wait for other tasks, otherwise the pools
+# could deadlock.
+POOLS = dict()
+_lock = threading.Lock()
+
+
+class Future(object):
+    """
+    Result of a task executed by a WorkerPool
+
+    The task runs within the deadline of the thread which submitted it (see
+    candlepin.budget).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._deadline = budget.current()
+
+    def _run(self, func, args, kwargs):
+        """
+        Execute the task and store its result (or exception)
+        """
+        try:
+            with budget.activate(self._deadline):
+                self._result = func(*args, **kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._event.set()
+
+    def _fail(self, exception):
+        """
+        Mark the task as failed without executing it
+        """
+        try:
+            raise exception
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._event.set()
+
+    def done(self):
+        """
+        :return bool: True if the task is finished
+        """
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the task and return its result
+
+        If the task raised an exception, it is re-raised here, in the caller's
+        thread.
+        :param timeout: Seconds to wait (wait forever by default)
+        :return: The value returned by the task
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError("Task did not finish in {0}s".format(timeout))
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class _Batch(object):
+    """
+    Tasks submitted together, optionally with a limit of running tasks
+    """
+
+    def __init__(self, tasks, limit=None):
+        self.tasks = deque(tasks)
+        self.limit = limit
+        self.running = 0
+
+    def ready(self):
+        """
+        :return bool: True if a task from the batch can be started now
+        """
+        return bool(self.tasks) and (self.limit is None or
+                                     self.running < self.limit)
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of persistent worker threads
+
+    Tasks are submitted in batches (typically one batch per request). Workers
+    take tasks from the pending batches in round-robin order, so a request with
+    many tasks doesn't starve the others. The number of threads caps the
+    concurrency across all requests in the process, a batch can limit its own
+    concurrency even further.
+    """
+
+    def __init__(self, name, size):
+        """
+        :param name: Pool identifier, used for thread names
+        :param size: Number of worker threads
+        """
+        self.name = name
+        self.size = size
+        self._batches = deque()
+        self._cond = threading.Condition()
+        self._threads = list()
+        self._shutdown = False
+
+    def _start(self):
+        """
+        Spawn the worker threads (called with the lock held)
+        """
+        for i in range(self.size - len(self._threads)):
+            t = threading.Thread(target=self._worker,
+                                 name="{0}-{1}".format(self.name, i))
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _next_batch(self):
+        """
+        Find the first batch a task can be started from (called with the lock
+        held), batches at their limit are skipped
+        :return _Batch: The batch or None
+        """
+        for i in range(len(self._batches)):
+            batch = self._batches.popleft()
+            if batch.ready():
+                return batch
+            self._batches.append(batch)
+        return None
+
+    def _worker(self):
+        """
+        Worker loop: pick a task from the next batch and execute it
+        """
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                while batch is None and not self._shutdown:
+                    self._cond.wait()
+                    batch = self._next_batch()
+                if batch is None:
+                    return
+
+                future, func, args, kwargs = batch.tasks.popleft()
+                batch.running += 1
+                # move the batch to the end of the line (round-robin)
+                if batch.tasks:
+                    self._batches.append(batch)
+
+            future._run(func, args, kwargs)
+
+            with self._cond:
+                batch.running -= 1
+                if batch.tasks and batch.limit is not None:
+                    # the batch may continue, wake up a worker
+                    self._cond.notify()
+
+    def _enqueue(self, batch):
+        """
+        Add a batch to the line and wake up the workers
+        """
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Worker pool '{0}' is shut down"
+                                   "".format(self.name))
+            self._start()
+            self._batches.append(batch)
+            self._cond.notify_all()
+
+    def map(self, func, items, limit=None):
+        """
+        Submit a batch of tasks, 'func' is called for each item
+        :param func: A callable taking a single argument
+        :param items: Iterable of arguments
+        :param limit: Maximum number of tasks from this batch running at once
+        :return list: Futures in the order of the items
+        """
+        batch = _Batch(((Future(), func, (item,), {}) for item in items),
+                       limit=limit)
+        futures = [task[0] for task in batch.tasks]
+        if futures:
+            self._enqueue(batch)
+        return futures
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Submit a single task
+        :param func: A callable to execute
+        :return Future: The task's future
+        """
+        future = Future()
+        self._enqueue(_Batch([(future, func, args, kwargs)]))
+        return future
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop the workers, tasks not started yet are failed
+        :param wait: Block until the workers finish the running tasks
+        :param timeout: Seconds to wait at most (wait forever by default)
+        """
+        with self._cond:
+            self._shutdown = True
+            pending, self._batches = self._batches, deque()
+            self._cond.notify_all()
+
+        for batch in pending:
+            for future, func, args, kwargs in batch.tasks:
+                future._fail(RuntimeError("Worker pool '{0}' is shut down"
+                                          "".format(self.name)))
+
+        if wait:
+            deadline = None if timeout is None else time.time() + timeout
+            for t in self._threads:
+                t.join(None if deadline is None
+                       else max(deadline - time.time(), 0))
+        logging.debug("[Executor] pool '{0}' shut down".format(self.name))
+
+
+def wait(futures, timeout=None):
+    """
+    Wait for the futures to finish
+    :param futures: Iterable of futures
+    :param timeout: Seconds to wait in total (wait forever by default)
+    :return tuple: (<list of finished futures>, <list of pending ones>)
+    """
+    futures = list(futures)
+    deadline = None if timeout is None else time.time() + timeout
+    for future in futures:
+        if deadline is None:
+            future._event.wait()
+        elif not future._event.wait(max(deadline - time.time(), 0)):
+            break
+    done = [f for f in futures if f.done()]
+    pending = [f for f in futures if not f.done()]
+    return done, pending
+
+
+def get_pool(name, size):
+    """
+    Get a process-wide worker pool, create it on the first call
+    :param name: Pool identifier
+    :param size: Number of worker threads (used when the pool is created)
+    :return WorkerPool: The pool instance
+    """
+    with _lock:
+        if name not in POOLS:
+            POOLS[name] = WorkerPool(name, size)
+        return POOLS[name]
+
+
+@atexit.register
+def shutdown(timeout=1):
+    """
+    Shut down all worker pools
+
+    The woken up workers are given a moment to exit before the interpreter is
+    torn down, workers still busy with a task are left behind (daemons).
+    :param timeout: Seconds to wait for the workers in total
+    """
+    with _lock:
+        pools = POOLS.values()
+        POOLS.clear()
+    deadline = time.time() + timeout
+    for pool in pools:
+        pool.shutdown(timeout=max(deadline - time.time(), 0))
@@ -0,0 +1,175 @@
+"""
+Hedged GET requests for idempotent reads
+
+When a request is not answered within the 95th percentile of the endpoint's
+recent latencies, a second (hedge) request is sent and whichever answers first
+is used. Hedging is opt-in (env.HEDGING) and the share of hedged requests is
+capped (env.HEDGE_MAX_RATE), so it never more than slightly adds to the load.
+Both attempts run in the 'hedges' worker pool.
+
+Use it for idempotent GETs only.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from Queue import Queue, Empty
+
+import candlepin as env
+import candlepin.breaker as breaker
+import candlepin.client as client
+import candlepin.executor as executor
+
+__author__ = "tcoufal"
+
+# Registry of latency trackers, one per endpoint
+TRACKERS = dict()
+_lock = threading.Lock()
+
+
+class LatencyTracker(object):
+    """
+    Recent latencies and hedging counters of a single endpoint
+    """
+
+    def __init__(self, window):
+        """
+        :param window: Number of recent latencies kept
+        """
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def count(self, hedge_won=False):
+        """
+        Count a request (or a request answered by its hedge)
+        :param hedge_won: The hedge answered first
+        """
+        with self._lock:
+            if hedge_won:
+                self.wins += 1
+            else:
+                self.requests += 1
+
+    def record(self, elapsed):
+        """
+        Record latency of a finished attempt
+        :param elapsed: Seconds the attempt took
+        """
+        with self._lock:
+            self.latencies.append(elapsed)
+
+    def p95(self):
+        """
+        :return float: 95th percentile of recent latencies (None if there are
+                       not enough samples yet)
+        """
+        with self._lock:
+            if len(self.latencies) < env.HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def may_hedge(self):
+        """
+        Account a hedge if the hedge rate allows it
+        :return bool: True if the hedge should be sent
+        """
+        with self._lock:
+            if self.hedged + 1 > env.HEDGE_MAX_RATE * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def stats(self):
+        """
+        Tracker statistics
+        :return dict: {'requests', 'hedged', 'wins', 'hedge_rate', 'p95'}
+        """
+        p95 = self.p95()
+        with self._lock:
+            rate = float(self.hedged) / self.requests if self.requests else 0.0
+            return {'requests': self.requests, 'hedged': self.hedged,
+                    'wins': self.wins, 'hedge_rate': rate, 'p95': p95}
+
+
+def get_tracker(name):
+    """
+    Get the latency tracker of the endpoint, create it on the first call
+    :param name: Endpoint identifier
+    :return LatencyTracker: The tracker instance
+    """
+    with _lock:
+        if name not in TRACKERS:
+            TRACKERS[name] = LatencyTracker(env.HEDGE_WINDOW)
+        return TRACKERS[name]
+
+
+def stats():
+    """
+    Statistics of all endpoints
+    :return dict: {<endpoint>: <tracker statistics>}
+    """
+    with _lock:
+        trackers = TRACKERS.items()
+    return {name: tracker.stats() for name, tracker in trackers}
+
+
+def get(url, **kwargs):
+    """
+    Send a GET request, hedge it if the first attempt is slow
+
+    Same as client.get() if hedging is disabled. Otherwise the first response
+    which arrives is returned; an exception is raised only if every attempt
+    sent failed.
+    :param url: URL of the request
+    :param kwargs: any other arguments accepted by requests
+    :return requests.Response: the response
+    """
+    if not env.HEDGING:
+        return client.get(url, **kwargs)
+
+    tracker = get_tracker(breaker.endpoint(url))
+    tracker.count()
+    delay = tracker.p95()
+
+    results = Queue()
+    pool = executor.get_pool('hedges', env.MAX_THREADS)
+
+    def attempt(index):
+        start = time.time()
+        try:
+            r = client.get(url, **kwargs)
+        except Exception as e:
+            results.put((index, None, e))
+        else:
+            tracker.record(time.time() - start)
+            results.put((index, r, None))
+
+    pool.submit(attempt, 0)
+    sent = 1
+    try:
+        index, r, error = results.get(timeout=delay) if delay is not None \
+            else results.get()
+    except Empty:
+        if tracker.may_hedge():
+            logging.debug("[Hedging] no response in {0:.3f}s, hedging '{1}'"
+                          "".format(delay, url))
+            pool.submit(attempt, 1)
+            sent = 2
+        index, r, error = results.get()
+
+    # the first answer was an error, wait for the other attempt
+    if error is not None and sent > 1:
+        other = results.get()
+        if other[2] is None:
+            index, r, error = other
+
+    if error is not None:
+        raise error
+    if index:
+        tracker.count(hedge_won=True)
+    return r
@@ -0,0 +1,114 @@
+"""
+Coalescing of identical calls in flight (single-flight)
+
+When a call is made while an identical one (same group and key) is still in
+progress, it doesn't query the upstream service again. It waits for the call
+in progress and shares its result (or exception) instead:
+
+    singleflight.do('multipliers', (key, sku), __fetch_multiplier, sku)
+
+Only calls running at the same time are coalesced, results are not kept (see
+candlepin.cache for that).
+"""
+
+import logging
+import threading
+
+import candlepin.budget as budget
+import candlepin.executor as executor
+
+__author__ = "tcoufal"
+
+# Registry of all groups in the process
+GROUPS = dict()
+_lock = threading.Lock()
+
+
+class Group(object):
+    """
+    Calls in flight of a single kind, keyed by their arguments
+    """
+
+    def __init__(self, name):
+        """
+        :param name: Group identifier
+        """
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._flights = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call the function unless an identical call is in flight already
+
+        The first caller executes the function in its own thread, the others
+        wait for its result (within their own time budget).
+        :param key: Hashable identification of the call
+        :param func: A callable to execute
+        :return: The value returned by the function
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = executor.Future()
+                self._flights[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            logging.debug("[Single-flight] '{0}' call joined".format(
+                self.name))
+            return future.result(budget.remaining())
+
+        try:
+            future._run(func, args, kwargs)
+        finally:
+            with self._lock:
+                del self._flights[key]
+        return future.result()
+
+    def stats(self):
+        """
+        Group statistics
+        :return dict: {'calls', 'shared', 'in_flight'}
+        """
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared,
+                    'in_flight': len(self._flights)}
+
+
+def get_group(name):
+    """
+    Get a process-wide group, create it on the first call
+    :param name: Group identifier
+    :return Group: The group instance
+    """
+    with _lock:
+        if name not in GROUPS:
+            GROUPS[name] = Group(name)
+        return GROUPS[name]
+
+
+def do(name, key, func, *args, **kwargs):
+    """
+    Call the function in the group, see Group.do()
+    :param name: Group identifier
+    :param key: Hashable identification of the call
+    :param func: A callable to execute
+    :return: The value returned by the function
+    """
+    return get_group(name).do(key, func, *args, **kwargs)
+
+
+def stats():
+    """
+    Statistics of all groups
+    :return dict: {<group name>: <group statistics>}
+    """
+    with _lock:
+        groups = GROUPS.items()
+    return {name: group.stats() for name, group in groups}
@@ -5,6 +5,6 @@ Subscription refreshing and creation
 """
 
 from refresh import refresh_pools
-from create import create_pool
+from create import create_pool, create_pools
 
 __author__ = "tcoufal"
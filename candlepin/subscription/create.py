@@ -1,62 +1,165 @@
 import logging
 import requests
 import json
+import copy
+from collections import OrderedDict
 
 import candlepin as env
+import candlepin.budget as budget
+import candlepin.client as client
 import candlepin.utils as utils
 
 __author__ = "tcoufal"
 
 
-def create_pool(username, sku, quantity, start_date):
+class OrderRejected(RuntimeError):
     """
-    SKU Subscription pool creation process
+    Raised when the order was refused (4xx), ie. no pool has been created
+    """
+    pass
 
-    A requester for a new pool for the given account (specified by a username).
-    Runs a query to the Stage Candlepin API hooking given SKU ID with the
-    account by creating a specific pool and returns it's ID.
+
+def __order(username, lines, start_date):
+    """
+    Send a single hock order, one order line per SKU
+
+    Connection errors (the order was not sent) and server errors (5xx) are
+    retried. A refused order (4xx) is not and neither is an order without a
+    response in time (it may still be processed).
     :param username: Account's username
-    :param sku: SKU the caller requests to subscribe
-    :param quantity: Pool quantity
-    :param start_date: A date by which the pool is available
-    :return int: A Pool ID of the created subscription pool
+    :param lines: List of (<SKU>, <pool quantity>) tuples, unique SKUs
+    :param start_date: A date by which the pools are available
+    :return dict: {<SKU>: <Pool ID of the created subscription pool>}
+    :raise OrderRejected: When the order was refused
     """
-    logging.debug('Initiated pool creation')
+    skus = [sku for sku, quantity in lines]
 
-    # Build a JSON/dict with the request data
+    # Build a JSON/dict with the request data, one line per SKU
     hock_info = utils.load_json(env.ATTACH_SKU_PATH)
     hock_info['login'] = username
-    hock_info['lines'][0]['productSKU'] = sku
-    line = hock_info['lines'][0]['lineItem']
-    line['sku'] = sku
-    line['quantity'] = quantity
-    line['entitlementStartDate'] = str(start_date)
+    template = hock_info['lines'][0]
+    hock_info['lines'] = list()
+    for sku, quantity in lines:
+        order_line = copy.deepcopy(template)
+        order_line['productSKU'] = sku
+        line = order_line['lineItem']
+        line['sku'] = sku
+        line['quantity'] = quantity
+        line['entitlementStartDate'] = str(start_date)
+        hock_info['lines'].append(order_line)
 
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            r = requests.put('{0}/hock/order'.format(env.REST_REGNUM),
-                             headers={'content-type': 'application/json'},
-                             data=json.dumps(hock_info))
-            regnum = str(json.loads(r.content)[
-                         'regNumbers'][0][0]['regNumber'])
-            r.raise_for_status()
-
-        except (KeyError, ValueError) as e:
-            logging.error("[Create Pool] failed to create pool for {0}: {1}"
-                          "".format(sku, e))
-            raise RuntimeError("Failed to create a {0} Subscription pool for "
-                               " '{1}' account".format(sku, username))
-
-        except (requests.ConnectionError, requests.HTTPError) as e:
-            logging.error("[Create Pool] failed to create pool for {0}: {1}"
-                          "".format(sku, e))
+            r = client.put('{0}/hock/order'.format(env.REST_REGNUM),
+                           headers={'content-type': 'application/json'},
+                           data=json.dumps(hock_info))
+        except requests.ConnectionError as e:
+            # includes ConnectTimeout, the order was not sent
+            logging.error("[Create Pool] failed to create pools for {0}: {1}"
+                          "".format(skus, e))
+            continue
+        except requests.Timeout as e:
+            # the order may still be processed, resending could duplicate it
+            logging.error("[Create Pool] no response to the order of {0}: {1}"
+                          "".format(skus, e))
+            raise RuntimeError("Failed to create {0} Subscription pools for "
+                               "'{1}' account".format(", ".join(skus),
+                                                      username))
+
+        if r.status_code >= 500:
+            logging.error("[Create Pool] failed to create pools for {0}: {1}"
+                          "".format(skus, r.status_code))
             continue
+        if r.status_code >= 400:
+            logging.error("[Create Pool] order of {0} refused: {1}".format(
+                skus, r.status_code))
+            raise OrderRejected("Failed to create {0} Subscription pools for "
+                                "'{1}' account".format(", ".join(skus),
+                                                       username))
         break
     else:
         logging.error("[Create Pool] out of retries")
-        raise RuntimeError("Failed to create a {0} Subscription pool for "
-                           " '{1}' account".format(sku, username))
+        raise RuntimeError("Failed to create {0} Subscription pools for "
+                           "'{1}' account".format(", ".join(skus), username))
+
+    try:
+        # registration numbers follow the order of the lines
+        reg_numbers = json.loads(r.content)['regNumbers']
+        if len(reg_numbers) != len(skus):
+            raise ValueError("{0} registration numbers returned for {1} "
+                             "lines".format(len(reg_numbers), len(skus)))
+        return {sku: str(entry[0]['regNumber'])
+                for sku, entry in zip(skus, reg_numbers)}
+
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        logging.error("[Create Pool] failed to create pools for {0}: {1}"
+                      "".format(skus, e))
+        raise RuntimeError("Failed to create {0} Subscription pools for "
+                           "'{1}' account".format(", ".join(skus), username))
+
+
+def create_pools(username, lines, start_date):
+    """
+    Multi-SKU Subscription pools creation process
 
-    logging.info("[Create Pool] successfully created SKU's '{0}' pool '{1}'"
-                 " for account '{2}'".format(sku, regnum, username))
-    return regnum
+    Same as create_pool() but all SKUs are sent in a single order, one order
+    line per SKU, so only one round trip is needed. Quantities of a repeated
+    SKU are added up. When the order is refused (eg. because of a single bad
+    line), each SKU is ordered on its own, so every SKU gets its own result.
+    :param username: Account's username
+    :param lines: List of (<SKU>, <pool quantity>) tuples
+    :param start_date: A date by which the pools are available
+    :return dict: {<SKU>: {'regnum': <Pool ID of the created subscription
+                                      pool or None>,
+                           'error': <error message or None>}}
+    """
+    logging.debug('Initiated pools creation')
+    quantities = OrderedDict()
+    for sku, quantity in lines:
+        quantities[sku] = quantities.get(sku, 0) + quantity
+    lines = quantities.items()
+
+    try:
+        regnums = __order(username, lines, start_date)
+        result = {sku: {'regnum': regnum, 'error': None}
+                  for sku, regnum in regnums.items()}
+    except OrderRejected as e:
+        if len(lines) == 1:
+            return {lines[0][0]: {'regnum': None, 'error': e.message}}
+
+        logging.info("[Create Pool] order refused, ordering {0} SKUs one by "
+                     "one".format(len(lines)))
+        result = dict()
+        for line in lines:
+            try:
+                regnum = __order(username, [line], start_date)[line[0]]
+                result[line[0]] = {'regnum': regnum, 'error': None}
+            except RuntimeError as e:
+                result[line[0]] = {'regnum': None, 'error': e.message}
+    except RuntimeError as e:
+        # the order may have been created, don't risk a duplicate one
+        return {sku: {'regnum': None, 'error': e.message}
+                for sku, quantity in lines}
+
+    logging.info("[Create Pool] created pools {0} for account '{1}'".format(
+        result, username))
+    return result
+
+
+def create_pool(username, sku, quantity, start_date):
+    """
+    SKU Subscription pool creation process
+
+    A requester for a new pool for the given account (specified by a username).
+    Runs a query to the Stage Candlepin API hooking given SKU ID with the
+    account by creating a specific pool and returns it's ID.
+    :param username: Account's username
+    :param sku: SKU the caller requests to subscribe
+    :param quantity: Pool quantity
+    :param start_date: A date by which the pool is available
+    :return int: A Pool ID of the created subscription pool
+    """
+    result = create_pools(username, [(sku, quantity)], start_date)[sku]
+    if result['error']:
+        raise RuntimeError(result['error'])
+    return result['regnum']
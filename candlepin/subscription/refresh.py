@@ -1,34 +1,40 @@
 import logging
 import requests
 import candlepin as env
-import candlepin.utils as utils
+import candlepin.budget as budget
+import candlepin.client as client
+from candlepin.context import AccountContext
 
 __author__ = "tcoufal"
 
 
-def refresh_pools(username):
+def refresh_pools(username, context=None):
     """
     Request a refresh for given account
 
     Calls the Candlepin API requesting all subscribed pool for given account to
     refresh.
     :param username: Candlepin account username
+    :param context: Optional AccountContext providing the Org ID
     :return bool: True if success, exception is raised otherwise
     """
     logging.debug("Refresh initiated")
 
     params = {'auto_create_owner': True}
+    context = context or AccountContext(username)
 
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            org_id = utils.get_orgid(username)
+            # NOTE: Org ID is remembered, so it's queried just once
+            org_id = context.org_id
             url = "{0}/owners/{1}/subscriptions".format(env.REST_CANDLEPIN,
                                                         org_id)
-            r = requests.put(url, params=params, verify=False,
-                             auth=(env.CANDLEPIN_USER, env.CANDLEPIN_PASSWORD))
+            r = client.put(url, params=params, verify=False,
+                           auth=(env.CANDLEPIN_USER, env.CANDLEPIN_PASSWORD))
             r.raise_for_status()
 
-        except (requests.ConnectionError, requests.HTTPError) as e:
+        except (requests.ConnectionError, requests.HTTPError,
+                requests.Timeout) as e:
             logging.error("[Refresh] Failed to query Candlepin: {0}".format(e))
             continue
         break
@@ -1,13 +1,35 @@
 import logging
 import os
 import json
+import hashlib
 import requests
 from itertools import ifilter
 
 import candlepin as env
+import candlepin.budget as budget
+import candlepin.client as client
+import candlepin.hedging as hedging
+import candlepin.singleflight as singleflight
+from candlepin.cache import TTLCache, NOT_FOUND
 
 __author__ = "tcoufal"
 
+# Multipliers don't change between calls, share them across all requests
+MULTIPLIERS = TTLCache('multipliers', env.MULTIPLIER_CACHE_SIZE,
+                       env.MULTIPLIER_CACHE_TTL)
+
+# Account identifiers (Org ID, user ID, ...) cached per username
+IDENTITIES = TTLCache('identities', env.IDENTITY_CACHE_SIZE,
+                      env.IDENTITY_CACHE_TTL)
+
+# Successfully verified credentials and credentials of accounts without Terms
+# accepted, both keyed by credentials_key()
+VERIFIED = TTLCache('verified', env.VERIFY_CACHE_SIZE, env.VERIFY_CACHE_TTL)
+INACTIVE = TTLCache('inactive', env.VERIFY_CACHE_SIZE, env.VERIFY_CACHE_TTL)
+
+# Salt for credentials hashing, unique for each process
+_SALT = os.urandom(16)
+
 
 def load_json(filename):
     """
@@ -21,18 +43,24 @@ def load_json(filename):
     return data
 
 
-def get_orgid(username):
+def __fetch_identity(username):
     """
-    Query Account's REST API and select the OrgID
+    Query Account's REST API for the account's identifiers
     :param username: A Candlepin account username
-    :return org_id: Account's org_id
+    :return dict: see get_identity()
     """
     logging.debug("[Org Id] query for OrgId initiated")
     try:
-        r = requests.get("{0}/login={1}".format(env.REST_USER, username))
+        r = hedging.get("{0}/login={1}".format(env.REST_USER, username))
         r.raise_for_status()
         data = json.loads(r.content)[0]
-        org_id = data['orgId']
+        identity = {
+            'org_id': str(data['orgId']),
+            'user_id': data.get('id'),
+            'oracle_id': (data.get('customer') or {}).get(
+                'oracleCustomerNumber'),
+            'customer_id': None
+        }
 
     except (KeyError, IndexError, ValueError):
         # When the user does not exist or the 'orgId' is missing
@@ -40,30 +68,159 @@ def get_orgid(username):
                       "".format(username, r.content))
         raise NameError('[Org Id] unable to fetch OrgID from Candlepin')
 
-    except (requests.HTTPError, requests.ConnectionError) as e:
+    except (requests.HTTPError, requests.ConnectionError,
+            requests.Timeout) as e:
         logging.error("[Org Id] failed to query Account's API: {0}".format(e))
         raise
 
     logging.debug("[Org Id] query for OrgId done")
-    return str(org_id)
+    return identity
+
+
+def __fetch_customer_id(oracle_id):
+    """
+    Query Account's REST API for the customer ID
+    :param oracle_id: Account's Oracle customer number
+    :return customer_id: Customer ID from Oracle
+    """
+    try:
+        r = client.get("{0}/customers/search".format(env.REST_USER),
+                       params={"oracleCustomerNumber": oracle_id, "max": 10})
+        r.raise_for_status()
+        customer_id = json.loads(r.content)[0]["id"]
+
+    except (KeyError, IndexError, ValueError):
+        logging.error("[Customer Id] missing for customer '{0}': {1}"
+                      "".format(oracle_id, r.content))
+        raise NameError('[Customer Id] unable to fetch customer ID')
+
+    except (requests.HTTPError, requests.ConnectionError,
+            requests.Timeout) as e:
+        logging.error("[Customer Id] failed to query Account's API: {0}"
+                      "".format(e))
+        raise
+
+    return customer_id
+
+
+def get_identity(username, customer=False):
+    """
+    Get all identifiers of the account
+
+    Identifiers are cached per username (see IDENTITIES). The customer ID
+    requires one more query, so it is fetched only when asked for.
+    :param username: A Candlepin account username
+    :param customer: Fetch the customer ID as well
+    :return dict: {'org_id': <Organization ID>,
+                   'user_id': <account Candlepin ID>,
+                   'oracle_id': <account Oracle ID>,
+                   'customer_id': <customer ID from Oracle or None>}
+    """
+    identity = IDENTITIES.get(username)
+    if identity is None:
+        # concurrent lookups of the same account share one query
+        identity = singleflight.do('identities', username, __fetch_identity,
+                                   username)
+        IDENTITIES.set(username, identity)
+
+    if customer and identity['customer_id'] is None:
+        customer_id = singleflight.do('customers', identity['oracle_id'],
+                                      __fetch_customer_id,
+                                      identity['oracle_id'])
+        identity = dict(identity, customer_id=customer_id)
+        IDENTITIES.set(username, identity)
+
+    return dict(identity)
+
+
+def invalidate_identity(username):
+    """
+    Forget cached identifiers of the account (eg. when it's (re)created)
+    :param username: A Candlepin account username
+    """
+    IDENTITIES.invalidate(username)
+
+
+def credentials_key(username, password):
+    """
+    Salted hash of the credentials, so they are never stored in plain text
+    :param username: Account's username
+    :param password: Account's password
+    :return str: Hex digest identifying the credentials
+    """
+    def encode(value):
+        # byte strings (eg. from CSV imports) are hashed as they are
+        return value.encode('utf-8') if isinstance(value, unicode) else value
+
+    h = hashlib.sha256(_SALT)
+    h.update(encode(username))
+    h.update('\0')
+    h.update(encode(password))
+    return h.hexdigest()
+
+
+def invalidate_credentials(username, password):
+    """
+    Forget the verification results for the credentials
+    :param username: Account's username
+    :param password: Account's password
+    """
+    key = credentials_key(username, password)
+    VERIFIED.invalidate(key)
+    INACTIVE.invalidate(key)
+
+
+def get_orgid(username):
+    """
+    Query Account's REST API and select the OrgID
+    :param username: A Candlepin account username
+    :return org_id: Account's org_id
+    """
+    return get_identity(username)['org_id']
 
 
 def get_multiplier(username, password, sku):
     """
     Query the Stage Candlepin for multipliers for the SKU
+
+    Results are cached per SKU (see MULTIPLIERS), SKUs that are not known to
+    Candlepin are cached as well, so they fail fast next time. Concurrent
+    lookups of the same SKU by the same account share one query.
     :param username: Account's username
     :param password: Account's password
     :param sku: Subscription SKU
     :return multiplier: SKU's miltiplier
     :return instance_multiplier: SKU's instance multiplier
     """
+    cached = MULTIPLIERS.get(sku)
+    if cached is NOT_FOUND:
+        raise NameError("[Multiplier] SKU '{0}' is not known to Candlepin"
+                        "".format(sku))
+    elif cached is not None:
+        return cached
+
+    # failures (eg. a wrong password or an expired budget) belong to the
+    # account, so only lookups made with the same credentials are shared
+    key = (credentials_key(username, password), sku)
+    return singleflight.do('multipliers', key, __fetch_multiplier, username,
+                           password, sku)
+
+
+def __fetch_multiplier(username, password, sku):
+    """
+    Query the Stage Candlepin for multipliers for the SKU, see get_multiplier()
+    :param username: Account's username
+    :param password: Account's password
+    :param sku: Subscription SKU
+    :return tuple: (<multiplier>, <instance multiplier>)
+    """
     logging.debug('[Multiplier] fetching a multiplier for sku: {0}'.format(sku))
 
     url = "https://{0}/subscription/products/{1}".format(env.STAGE_CANDLEPIN,
                                                         sku)
-    for attempt in range(env.RETRY):
+    for attempt in budget.attempts():
         try:
-            r = requests.get(url, verify=False, auth=(username, password))
+            r = hedging.get(url, verify=False, auth=(username, password))
             r.raise_for_status()
             data = json.loads(r.content)
 
@@ -83,16 +240,28 @@ def get_multiplier(username, password, sku):
                           .format(username, sku, r.content, e))
             continue
 
-        except (requests.HTTPError, requests.ConnectionError) as e:
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                # SKU is missing, no reason to retry
+                logging.error("[Multiplier] sku '{0}' not found".format(sku))
+                MULTIPLIERS.set(sku, NOT_FOUND,
+                                ttl=env.MULTIPLIER_NEGATIVE_TTL)
+                raise NameError("[Multiplier] SKU '{0}' is not known to "
+                                "Candlepin".format(sku))
             logging.error("[Multiplier] request failed for account '{0}', "
-                          "sku '{1}' ({2}): {3}"
-                          "".format(username, sku, r.content, e))
+                          "sku '{1}': {2}".format(username, sku, e))
+            continue
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logging.error("[Multiplier] request failed for account '{0}', "
+                          "sku '{1}': {2}".format(username, sku, e))
             continue
         break
     else:
         # if we run out of retries (only due to the 'continue' statement),
         # through an error
-        raise NameError("[Multiplier] unable to fetch multiplier for '{0}' from Candlepin"
-                        "".format(sku))
+        raise ValueError("[Multiplier] unable to fetch multiplier for '{0}' "
+                         "from Candlepin".format(sku))
 
+    MULTIPLIERS.set(sku, (multiplier, instance_multiplier))
     return multiplier, instance_multiplier
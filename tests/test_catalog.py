@@ -0,0 +1,146 @@
+"""
+Parity of the in-memory SKU catalog with the SQL search
+
+Every operator in CHOICES['compare'] (and the sorting) is evaluated by both
+search engines against a local SQLite database, the results must be the same.
+Run: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+__author__ = "tcoufal"
+
+WSGI = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'wsgi')
+
+try:
+    import numpy
+    import peewee
+except ImportError:
+    numpy = peewee = None
+
+# Values stored in the table, None is NULL
+STRINGS = [None, u'', u'abc', u'ABC', u'abc ', u'n/a', u'N/A', u'a_c',
+           u'a%c', u'x\\y']
+INTEGERS = [None, -2, -1, 0, 1, 4, 16]
+BOOLEANS = [None, 0, 1]
+
+# Values searched for
+STRING_VALUES = [u'abc', u'ABC', u'abc ', u'n/a', u'none', u'', u'b',
+                 u'_', u'%', u'a_c', u'\\']
+INTEGER_VALUES = [u'0', u'1', u'4', u'-1', u'n/a', u'unlimited']
+BOOLEAN_VALUES = [u'true', u'false', u'1', u'0']
+
+
+@unittest.skipIf(numpy is None, 'NumPy and peewee are required')
+class CatalogParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.mkdtemp()
+        os.chdir(cls.tmp)
+        os.environ['ETHEL_LOCAL_DB'] = 'true'
+        sys.path.insert(0, WSGI)
+
+        from database import DB, SkuEntry, table_version
+        DB.connect()
+        SkuEntry.create_table()
+        cls.fill(SkuEntry)
+        DB.close()
+
+        # choices are fetched from the database once it's populated
+        from choices import CHOICES
+        import catalog
+        cls.DB, cls.SkuEntry, cls.CHOICES = DB, SkuEntry, CHOICES
+        cls.catalog = catalog.Catalog(60)
+        cls.catalog._snapshot = cls.catalog._load(table_version())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.DB.close()
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.tmp)
+
+    @staticmethod
+    def fill(model):
+        """
+        Insert rows combining the values of all column types
+        """
+        fields = model._meta.sorted_fields
+        size = len(STRINGS) * len(INTEGERS)
+        for i in range(size):
+            row = {'id': u'SKU{0:03d}'.format(i)}
+            for j, field in enumerate(fields):
+                if field.name == 'id':
+                    continue
+                values = {'string': STRINGS, 'int': INTEGERS,
+                          'bool': BOOLEANS}[field.db_field]
+                row[field.name] = values[(i + j * 3) % len(values)]
+            model.insert(**row).execute()
+
+    def sql_ids(self, query):
+        return [entry.id for entry in query]
+
+    def catalog_ids(self, filters, params=None):
+        total, filtered, entries = self.catalog.search(filters, params)
+        return [entry['id'] for entry in entries]
+
+    def test_operators(self):
+        values = {'string': STRING_VALUES, 'int': INTEGER_VALUES,
+                  'bool': BOOLEAN_VALUES}
+        for field in self.SkuEntry._meta.sorted_fields:
+            operators = self.CHOICES['compare'][field.db_field]
+            for name, op in operators.items():
+                if name in self.CHOICES['compare_no_value']:
+                    cases = [[]]
+                else:
+                    cases = [[v] for v in values[field.db_field]]
+                for args in cases:
+                    query = self.SkuEntry.select().where(op(field, *args)) \
+                        .order_by(self.SkuEntry.id)
+                    self.assertEqual(
+                        self.catalog_ids([(field, name, args)]),
+                        self.sql_ids(query),
+                        "'{0}' {1} {2}".format(field.name, name, args))
+
+    def test_order(self):
+        for field in self.SkuEntry._meta.sorted_fields:
+            for desc in (False, True):
+                params = {'start': 0, 'length': -1, 'term': None,
+                          'order': [(field, desc)], 'fields': None}
+                query = self.SkuEntry.select().order_by(
+                    field.desc() if desc else field.asc(), self.SkuEntry.id)
+                self.assertEqual(self.catalog_ids([], params),
+                                 self.sql_ids(query),
+                                 "'{0}' desc={1}".format(field.name, desc))
+
+    def test_term_and_paging(self):
+        strings = [f for f in self.SkuEntry._meta.sorted_fields
+                   if f.db_field == 'string']
+        for term in STRING_VALUES:
+            params = {'start': 3, 'length': 5, 'term': term, 'order': [],
+                      'fields': None}
+            query = self.SkuEntry.select().where(
+                reduce(lambda a, b: a | b, [f.contains(term)
+                                            for f in strings]))
+            total, filtered, entries = self.catalog.search([], params)
+            self.assertEqual(filtered, query.count(), term)
+            self.assertEqual(
+                [entry['id'] for entry in entries],
+                self.sql_ids(query.order_by(self.SkuEntry.id)
+                             .offset(3).limit(5)), term)
+
+    def test_display(self):
+        from database import serialize
+        params = {'start': 0, 'length': -1, 'term': None, 'order': [],
+                  'fields': None}
+        self.assertEqual(
+            self.catalog.search([], params)[2],
+            serialize(self.SkuEntry.select().order_by(self.SkuEntry.id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
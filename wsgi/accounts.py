@@ -0,0 +1,179 @@
+"""
+Account operations
+
+Multi-step account operations shared by the AJAX handlers and the background
+jobs (eg. bulk import).
+"""
+import csv
+import logging
+from datetime import datetime, timedelta
+
+import candlepin
+import utils
+import environment as env
+
+__author__ = "tcoufal"
+
+
+def start_date(expire=None):
+    """
+    Compute the pool start date
+
+    Subscription is 1 year long, compute the creation date to meet expiration
+    :param expire: Optional datetime of the subscription expiration
+    :return date: A date by which the pool is available
+    """
+    if expire:
+        return expire.date() - timedelta(days=364)
+    return datetime.today().date()
+
+
+def __activate_sku(username, org_id, regnum, start):
+    """
+    Activate a pool created for a single SKU
+
+    :param username: Account's username
+    :param org_id: Account's org ID
+    :param regnum: Registration number of the created pool
+    :param start: A date by which the pool is available
+    :return dict: {'regnum': <created regnum>, 'activated': <bool>,
+                   'error': <error message or None>}
+    """
+    result = {'regnum': regnum, 'activated': False, 'error': None}
+    try:
+        result['activated'] = candlepin.account.activate_pool(
+            username, org_id, regnum, start)
+    except Exception as e:
+        logging.error("[Attach] failed to activate '{0}' for '{1}': {2}"
+                      "".format(regnum, username, e))
+        result['error'] = str(e)
+    return result
+
+
+def attach(username, lines, start, context=None):
+    """
+    Attach Subscriptions to an account
+
+    All SKUs are checked against the database at once, pools for the known
+    ones are created in a single order and then activated independently, up to
+    env.ATTACH_PARALLELISM pools at once.
+    :param username: Account's username
+    :param lines: List of (<SKU>, <quantity>) tuples
+    :param start: A date by which the pools are available
+    :param context: Optional AccountContext providing the Org ID
+    :return dict: {<sku>: {'regnum': <created regnum>,
+                           'activated': <bool>,
+                           'error': <error message or None>}}
+    """
+    context = context or candlepin.AccountContext(username)
+    org_id = context.org_id
+
+    # Check all SKUs at once, attach just the known ones
+    unknown = utils.check_skus(sku for sku, quantity in lines)
+    result = {sku: {'regnum': None, 'activated': False,
+                    'error': 'SKU is not present in the database'}
+              for sku in unknown}
+
+    # Create pools for all known SKUs in a single order
+    lines = [(sku, quantity) for sku, quantity in lines if sku not in unknown]
+    regnums = dict()
+    if lines:
+        for sku, pool in candlepin.subscription.create_pools(
+                username, lines, start).items():
+            if pool['error']:
+                result[sku] = {'regnum': None, 'activated': False,
+                               'error': pool['error']}
+            else:
+                regnums[sku] = pool['regnum']
+
+    # Activate the pools, only once they are created
+    created = regnums.keys()
+    pool = candlepin.executor.get_pool('calls', candlepin.MAX_THREADS)
+    futures = pool.map(
+        lambda sku: __activate_sku(username, org_id, regnums[sku], start),
+        created, limit=env.ATTACH_PARALLELISM)
+    result.update(zip(created, [f.result() for f in futures]))
+    return result
+
+
+def parse_csv(stream):
+    """
+    Parse accounts to import from a CSV file
+
+    The file is processed line by line, each line describes one account:
+    <username>,<password>[,<SKU>,<quantity>]...
+    :param stream: File-like object with the CSV data
+    :return generator: Yields dicts {'username': <username>,
+                                     'password': <password>,
+                                     'pools': <list of (<SKU>, <quantity>)>,
+                                     'error': <error message or None>}
+    """
+    for row in csv.reader(stream):
+        row = [cell.strip() for cell in row]
+        if not row or not row[0]:
+            # empty line
+            continue
+
+        account = {'username': row[0], 'password': None, 'pools': list(),
+                   'error': None}
+        try:
+            account['password'] = row[1]
+            for field in ('username', 'password'):
+                func, msg = utils.VALIDATORS[field]
+                if not func(account[field]):
+                    raise AssertionError(msg)
+
+            for sku, quantity in zip(row[2::2], row[3::2] + [None]):
+                # in case of comma at the end of line
+                if not sku:
+                    continue
+                try:
+                    account['pools'].append((sku, int(quantity)))
+                except (TypeError, ValueError):
+                    raise AssertionError("Quantity '{0}' of '{1}' is not "
+                                         "valid input".format(quantity, sku))
+
+        except IndexError:
+            account['error'] = 'Unable to parse password'
+        except AssertionError as e:
+            account['error'] = e.message
+        yield account
+
+
+def import_account(username, password, lines, activate=False, progress=None):
+    """
+    Import pipeline for a single account
+
+    Create the account, attach the Subscriptions, refresh the pools and accept
+    Terms and Conditions if requested.
+    :param username: Account's username
+    :param password: Account's password
+    :param lines: List of (<SKU>, <quantity>) tuples to attach
+    :param activate: Accept Terms and Conditions as well
+    :param progress: Optional callable, called with description of each
+                     finished step
+    """
+    progress = progress or (lambda step: None)
+    context = candlepin.AccountContext(username, password)
+
+    candlepin.account.create_new(username, password, context=context)
+    progress('Empty account created')
+
+    if lines:
+        result = attach(username, lines, start_date(), context=context)
+        failed = [sku for sku, r in result.items() if r['error']]
+        if failed:
+            raise RuntimeError("Failed to attach SKUs {0}: {1}".format(
+                failed, [result[sku]['error'] for sku in failed]))
+        progress('All pools attached')
+
+    candlepin.subscription.refresh_pools(username, context=context)
+    progress('Refresh successful')
+
+    if activate:
+        r = candlepin.account.accept_terms(username, password,
+                                           context=context)
+        if r['failed']:
+            raise RuntimeError("Failed to accept some Ts&Cs: {0}"
+                               "".format(r['failed']))
+        progress('Ts&Cs accepted')
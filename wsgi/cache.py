@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from json import dumps
+
+__author__ = "tcoufal"
+
+
+def normalize(data):
+    """
+    Normalized form of a search request, used as a cache key
+
+    Filters are joined by AND, so their order doesn't matter. Sorting refers to
+    columns by their names, so the column layout of the table doesn't matter
+    either. The DataTables' request counter ('draw') is ignored.
+    :param data: Search request, see search() in ethel.py
+    :return str: The key
+    """
+    def filters(items):
+        return sorted(dumps([i['key'], i['operator'], i.get('value')])
+                      for i in items)
+
+    if not isinstance(data, dict):
+        return dumps({'filters': filters(data)}, sort_keys=True)
+
+    columns = data.get('columns') or []
+    order = [(columns[int(i['column'])]['data'], i.get('dir'))
+             for i in data.get('order') or []]
+    return dumps({
+        'filters': filters(data.get('filters', [])),
+        'start': data.get('start'),
+        'length': data.get('length'),
+        'order': order,
+        'search': (data.get('search') or {}).get('value'),
+        'fields': sorted(set(data.get('fields') or []))
+    }, sort_keys=True)
+
+
+class SearchCache(object):
+    """
+    Thread-safe LRU cache of encoded search results bounded by memory
+
+    Entries are valid as long as the table doesn't change. The table version
+    (see database.table_version()) is checked at most once per 'interval'
+    seconds, when it changes all entries are dropped. Hits, misses and
+    invalidations are counted so the cache efficiency can be monitored.
+    """
+
+    def __init__(self, maxbytes, interval):
+        """
+        :param maxbytes: Maximum size of all entries (in bytes)
+        :param interval: Seconds between the table version checks
+        """
+        self.maxbytes = maxbytes
+        self.interval = interval
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.version = None
+        self._changed = None
+        self._checked = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, version):
+        """
+        Drop all entries if the table has changed
+        :param version: Callable returning the current table version
+        """
+        with self._lock:
+            if time.time() - self._checked < self.interval:
+                return
+            self._checked = time.time()
+
+        current = version()
+        with self._lock:
+            if current != self.version:
+                if self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self.size = 0
+                self.version = current
+                self._changed = time.time()
+
+    def get(self, key):
+        """
+        Look up search results
+        :param key: Normalized search request, see normalize()
+        :return str: Cached results (JSON) or None
+        """
+        with self._lock:
+            try:
+                size, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # re-insert to mark the entry as the most recently used
+            self._data[key] = (size, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size, version):
+        """
+        Store search results, the least recently used ones are dropped to
+        make room for them. Results computed for an older table version than
+        the current one are not stored.
+        :param key: Normalized search request, see normalize()
+        :param value: Results to store (JSON)
+        :param size: Size of the results (in bytes)
+        :param version: Table version known when the search started
+        """
+        if size > self.maxbytes:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            self._data[key] = (size, value)
+            self.size += size
+            while self.size > self.maxbytes:
+                self.size -= self._data.popitem(last=False)[1][0]
+
+    def stats(self):
+        """
+        Cache statistics
+        :return dict: {'entries', 'size', 'maxbytes', 'hits', 'misses',
+                       'hit_ratio', 'invalidations', 'version',
+                       'version_age': <seconds since the table changed>,
+                       'checked_ago': <seconds since the last version check>}
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            now = time.time()
+            return {
+                'entries': len(self._data),
+                'size': self.size,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / total if total else 0.0,
+                'invalidations': self.invalidations,
+                'version': self.version,
+                'version_age': now - self._changed if self._changed else None,
+                'checked_ago': now - self._checked if self._checked else None
+            }
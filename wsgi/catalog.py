@@ -0,0 +1,351 @@
+"""
+In-memory columnar SKU catalog
+
+Optional search engine (requires NumPy): the whole SKU table is loaded into
+typed column arrays and searches are evaluated as vectorized masks instead of
+querying the database. Results (filters, global search term, ordering, paging
+and the displayed values) are the same as of the SQL search:
+- NULLs follow the SQL three-valued logic, the -1 (n/a) and -2 (unlimited)
+  encodings of integer columns are kept as they are stored,
+- strings are compared as by MySQL's default collation (case-insensitive,
+  trailing spaces ignored, accents are not folded though) or exactly for
+  SQLite, LIKE patterns keep their wildcards.
+
+The table is checked for changes in the background and reloaded, so results
+can be behind the database for 'interval' seconds at most. Searches the
+catalog can't evaluate fall back to the database.
+"""
+
+import logging
+import re
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    # optional, searches always query the database then
+    numpy = None
+
+from peewee import MySQLDatabase
+
+from database import DB, SkuEntry, table_version
+
+__author__ = "tcoufal"
+
+_MYSQL = isinstance(DB, MySQLDatabase)
+
+
+def _fold(value):
+    """
+    Collation key of a string for comparison and ordering
+    """
+    if _MYSQL:
+        return value.upper().rstrip(u' ')
+    return value
+
+
+def _fold_like(value):
+    """
+    Collation key of a string for LIKE matching (SQLite folds ASCII only)
+    """
+    if _MYSQL:
+        return value.upper()
+    return u''.join(c.upper() if c < u'\x80' else c for c in value)
+
+
+def _like(pattern):
+    """
+    Translate a LIKE pattern into a regular expression
+    :param pattern: LIKE pattern ('%' any string, '_' any character, MySQL
+                    escapes them by a backslash)
+    :return: Compiled regular expression matching the whole (folded) string
+    """
+    regex = list()
+    escape = False
+    for c in _fold_like(pattern):
+        if escape or (c not in u'%_\\') or (c == u'\\' and not _MYSQL):
+            regex.append(re.escape(c))
+            escape = False
+        elif c == u'\\':
+            escape = True
+        else:
+            regex.append(u'.*' if c == u'%' else u'.')
+    if escape:
+        regex.append(re.escape(u'\\'))
+    return re.compile(u''.join(regex) + u'\\Z', re.DOTALL | re.UNICODE)
+
+
+class _Column(object):
+    """
+    Single column of the catalog
+    """
+
+    def __init__(self, field, raw):
+        """
+        :param field: SkuEntry field
+        :param raw: List of raw database values
+        """
+        self.field = field
+        self.null = numpy.array([v is None for v in raw], dtype=bool)
+        self.display = [field.to_string(v) for v in raw]
+
+        if field.db_field == 'string':
+            text = [u'' if v is None else unicode(v) for v in raw]
+            self.values = numpy.array([_fold(v) for v in text],
+                                      dtype=numpy.unicode_)
+            self.like = numpy.array([_fold_like(v) for v in text],
+                                    dtype=numpy.unicode_)
+            # ordering key, equal strings (by collation) share their rank
+            self.rank = numpy.unique(self.values, return_inverse=True)[1]
+        else:
+            self.values = numpy.array([0 if v is None else int(v)
+                                       for v in raw], dtype=numpy.int64)
+            self.rank = self.values
+
+    def equals(self, value):
+        """
+        Mask of 'column = value' (NULL rows never match)
+        """
+        if value is None:
+            return numpy.zeros(len(self.null), dtype=bool)
+        if self.field.db_field == 'string':
+            return ~self.null & (self.values == _fold(unicode(value)))
+        return ~self.null & (self.values == int(value))
+
+    def like_mask(self, pattern):
+        """
+        Mask of 'column LIKE pattern' (NULL rows never match)
+        """
+        inner = pattern[1:-1]
+        if pattern.startswith(u'%') and pattern.endswith(u'%') and \
+                not any(c in inner for c in u'%_\\'):
+            # a plain substring, no need for regular expressions
+            found = numpy.char.find(self.like, _fold_like(inner)) >= 0
+        else:
+            regex = _like(pattern)
+            found = numpy.array([bool(regex.match(v)) for v in self.like],
+                                dtype=bool)
+        return ~self.null & found
+
+
+def _contains(column, value):
+    pattern = column.field.db_value(u'%%%s%%' % value)
+    return column.like_mask(pattern)
+
+
+def _compare(column, value, op):
+    value = column.field.db_value(value)
+    if value is None:
+        return numpy.zeros(len(column.null), dtype=bool)
+    return ~column.null & op(column.values, int(value)) & \
+        (column.values >= column.field.db_value(0))
+
+
+def _empty(column):
+    return column.equals(column.field.db_value(-1)) | column.null
+
+
+# Masks of all operators in CHOICES['compare'], following the same SQL
+# expressions (see choices.py), eg. NOT(a = -1 OR a IS NULL) is false for NULL
+OPERATORS = {
+    "equals": lambda c, v: c.equals(c.field.db_value(v)),
+    "does not equal": lambda c, v: (~c.null & ~c.equals(c.field.db_value(v))
+                                    if c.field.db_value(v) is not None
+                                    else c.equals(None)),
+    "contains": _contains,
+    "does not contain": lambda c, v: ~c.null & ~_contains(c, v),
+    "greater than": lambda c, v: _compare(c, v, numpy.greater),
+    "less then": lambda c, v: _compare(c, v, numpy.less),
+    "empty or not applicable": _empty,
+    "applicable": lambda c: ~c.null & ~_empty(c),
+    "unlimited": lambda c: c.equals(c.field.db_value(-2))
+}
+
+
+class _Snapshot(object):
+    """
+    The whole table loaded at once
+    """
+
+    def __init__(self, rows, version):
+        """
+        :param rows: Raw rows of all fields (in SkuEntry's field order)
+        :param version: Table version the rows belong to
+        """
+        fields = SkuEntry._meta.sorted_fields
+        columns = zip(*rows) if rows else [()] * len(fields)
+        self.size = len(rows)
+        self.version = version
+        self.loaded = time.time()
+        self.columns = {f.name: _Column(f, list(c))
+                        for f, c in zip(fields, columns)}
+
+
+class Catalog(object):
+    """
+    SKU table held in memory, refreshed in the background
+    """
+
+    def __init__(self, interval):
+        """
+        :param interval: Seconds between the table version checks
+        """
+        self.interval = interval
+        self.loads = 0
+        self.searches = 0
+        self.fallbacks = 0
+        self._snapshot = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Load the table and keep it up to date in a background thread
+        """
+        t = threading.Thread(target=self._refresh, name='catalog')
+        t.setDaemon(True)
+        t.start()
+
+    def _refresh(self):
+        """
+        Refresh loop: reload the table whenever its version changes
+        """
+        while True:
+            try:
+                DB.connect()
+                try:
+                    version = table_version()
+                    snapshot = self._snapshot
+                    if snapshot is None or snapshot.version != version:
+                        self._snapshot = self._load(version)
+                finally:
+                    DB.close()
+            except Exception as e:
+                logging.error("[Catalog] refresh failed: {0}".format(e))
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _load(self, version):
+        """
+        Load the whole table
+        :param version: Current table version
+        :return _Snapshot: The loaded table
+        """
+        fields = SkuEntry._meta.sorted_fields
+        sql, params = SkuEntry.select(*fields).sql()
+        rows = DB.execute_sql(sql, params).fetchall()
+        self._count('loads')
+        logging.info("[Catalog] loaded {0} SKUs".format(len(rows)))
+        return _Snapshot(rows, version)
+
+    def search(self, filters, params=None, version=None):
+        """
+        Evaluate a search, see search() in ethel.py
+
+        When the table is known to have changed since it was loaded, the search
+        is left to the database and the table is reloaded right away.
+
+        :param filters: Validated filters, see __search_filters() in ethel.py
+        :param params: Paging, sorting, search and projection parameters, see
+                       __search_params() in ethel.py (None for all entries
+                       sorted by SKU)
+        :param version: Current table version, if known (see
+                        database.table_version())
+        :return tuple: (<number of entries matching the filters>,
+                        <number of entries matching the search term as well>,
+                        <list of entries, see database.serialize()>)
+                       or None when the search has to query the database
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if version is not None and version != snapshot.version:
+            self._count('fallbacks')
+            self._wake.set()
+            return None
+
+        params = params or {'start': 0, 'length': -1, 'term': None,
+                            'order': [], 'fields': None}
+        columns = snapshot.columns
+        try:
+            mask = numpy.ones(snapshot.size, dtype=bool)
+            for field, name, values in filters:
+                mask &= OPERATORS[name](columns[field.name], *values)
+            total = int(mask.sum())
+
+            if params['term']:
+                found = numpy.zeros(snapshot.size, dtype=bool)
+                for column in columns.values():
+                    if column.field.db_field == 'string':
+                        found |= _contains(column, params['term'])
+                mask &= found
+            filtered = int(mask.sum())
+
+        except (KeyError, ValueError, TypeError, UnicodeError) as e:
+            # let the database decide (and report the error the same way)
+            logging.warning("[Catalog] search not evaluated: {0}".format(e))
+            self._count('fallbacks')
+            return None
+
+        # sort data, SKU ID makes the order unique; NULLs go first when
+        # sorting in ascending order, last otherwise
+        index = numpy.flatnonzero(mask)
+        keys = list()
+        for field, desc in params['order']:
+            column = columns[field.name]
+            keys.append(column.null[index] if desc else ~column.null[index])
+            keys.append(-column.rank[index] if desc else column.rank[index])
+        keys.append(columns['id'].rank[index])
+        index = index[numpy.lexsort(keys[::-1])]
+
+        if params['length'] >= 0:
+            index = index[params['start']:params['start'] + params['length']]
+
+        fields = params['fields'] or SkuEntry._meta.sorted_fields
+        names = [field.name for field in fields]
+        values = [[columns[name].display[i] for i in index] for name in names]
+        self._count('searches')
+        return total, filtered, [dict(zip(names, row))
+                                 for row in zip(*values)]
+
+    def _count(self, name):
+        """
+        Increment a counter (searches run in many threads at once)
+        :param name: Name of the counter
+        """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        """
+        Catalog statistics
+        :return dict: {'rows', 'version', 'age', 'loads', 'searches',
+                       'fallbacks'}
+        """
+        snapshot = self._snapshot
+        with self._lock:
+            return {
+                'rows': snapshot.size if snapshot else None,
+                'version': snapshot.version if snapshot else None,
+                'age': time.time() - snapshot.loaded if snapshot else None,
+                'loads': self.loads,
+                'searches': self.searches,
+                'fallbacks': self.fallbacks
+            }
+
+
+def start(interval):
+    """
+    Start the catalog if NumPy is available
+
+    :param interval: Seconds between the table version checks
+    :return Catalog: The catalog or None if it can't be used
+    """
+    if numpy is None:
+        logging.warning("[Catalog] NumPy is not installed, searches query "
+                        "the database")
+        return None
+    catalog = Catalog(interval)
+    catalog.start()
+    return catalog
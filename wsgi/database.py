@@ -1,3 +1,4 @@
+import hashlib
 import os
 from json import dumps
 from collections import OrderedDict
@@ -9,6 +10,14 @@ except ImportError:
           '\"pip install peewee\"\n'
           'Maybe you are also missing a library for MySQL and MariaDB: '
           '\"pip install PyMySQL\" or \"pip install MySQLdb\"\n')
+# unbuffered cursor of the MySQL driver peewee uses
+try:
+    from pymysql.cursors import SSCursor
+except ImportError:
+    try:
+        from MySQLdb.cursors import SSCursor
+    except ImportError:
+        SSCursor = None
 
 import environment as env
 
@@ -74,6 +83,13 @@ class _IntegerField(Field):
         else:
             return str(value)
 
+    def to_string(self, value):
+        """
+        Display a raw database value as a string, same as str() of the value
+        returned by python_value(). Used for bulk serialization.
+        """
+        return str(self.python_value(value))
+
 
 class _BooleanField(Field):
     """
@@ -101,6 +117,13 @@ class _BooleanField(Field):
         """
         return bool(value)
 
+    def to_string(self, value):
+        """
+        Display a raw database value as a string, same as str() of the value
+        returned by python_value(). Used for bulk serialization.
+        """
+        return 'True' if value else 'False'
+
 
 class _CharField(CharField):
     """
@@ -130,6 +153,17 @@ class _CharField(CharField):
             value = ''
         return value
 
+    def to_string(self, value):
+        """
+        Display a raw database value as a string, same as SkuEntry.dict() does
+        with the value returned by python_value(). Used for bulk serialization.
+        """
+        value = self.python_value(value)
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return dumps(value)
+
 
 class SkuEntry(Model):
     """
@@ -182,6 +216,8 @@ class SkuEntry(Model):
     def dict(self):
         """
         Dump model (entry) to dict for easier manipulation
+
+        NOTE: To dump many entries at once use serialize() instead.
         """
         r = dict()
         for k in self._meta.fields.keys():
@@ -212,3 +248,86 @@ order = ['id', 'ph_category', 'ph_product_line', 'ph_product_name',
 LAYOUT = OrderedDict()
 [LAYOUT.update({field: SkuEntry._meta.fields[field].verbose_name})
  for field in order]
+
+
+def iterate(query, fields=None, chunk=env.SEARCH_CHUNK, unbuffered=False):
+    """
+    Dump entries selected by the query to dicts chunk by chunk
+
+    Fast path for large results: only the requested columns are selected, raw
+    rows are fetched from the cursor in chunks without building model instances
+    and the values are mapped to strings column by column (see to_string() of
+    the fields). With an unbuffered cursor only a single chunk is held in
+    memory at a time (MySQL's default cursor receives the whole result at
+    once).
+    :param query: SkuEntry select query
+    :param fields: List of fields to dump (all by default)
+    :param chunk: Number of rows fetched at once
+    :param unbuffered: Read rows from the server as they are fetched, no other
+                       query can run on the connection in the meantime
+    :return generator: Lists of entries as dicts, see SkuEntry.dict()
+    """
+    fields = fields or SkuEntry._meta.sorted_fields
+    names = [field.name for field in fields]
+    sql, params = query.select(*fields).sql()
+    if unbuffered and SSCursor and isinstance(DB, MySQLDatabase):
+        cursor = DB.get_conn().cursor(SSCursor)
+        cursor.execute(sql, params)
+    else:
+        cursor = DB.execute_sql(sql, params)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            columns = [map(field.to_string, column)
+                       for field, column in zip(fields, zip(*rows))]
+            yield [dict(zip(names, row)) for row in zip(*columns)]
+    finally:
+        # an unbuffered cursor has to be read up before the connection is used
+        cursor.close()
+
+
+def table_version():
+    """
+    Cheap fingerprint of the SKU table, changes whenever the table does
+
+    Consists of the number of rows and an update marker: the time of the last
+    update if MySQL tracks it, a checksum of the table otherwise (MySQL doesn't
+    track it for InnoDB before 5.7 and forgets it on restart, SQLite never
+    does).
+    :return tuple: (<row count>, <last update time or checksum>)
+    """
+    marker = None
+    if isinstance(DB, MySQLDatabase):
+        cursor = DB.execute_sql(
+            "SELECT UPDATE_TIME FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+            (env.DB_NAME, env.DB_TABLE))
+        row = cursor.fetchone()
+        if row and row[0]:
+            marker = str(row[0])
+        else:
+            cursor = DB.execute_sql("CHECKSUM TABLE `{0}`".format(
+                env.DB_TABLE))
+            row = cursor.fetchone()
+            marker = row[1] if row else None
+    else:
+        # local database, small enough to be checksummed row by row
+        digest = hashlib.sha1()
+        sql, params = SkuEntry.select().order_by(SkuEntry.id).sql()
+        for row in DB.execute_sql(sql, params):
+            digest.update(repr(row))
+        marker = digest.hexdigest()
+    return SkuEntry.select().count(), marker
+
+
+def serialize(query, fields=None):
+    """
+    Dump entries selected by the query to dicts, see iterate()
+    :param query: SkuEntry select query
+    :param fields: List of fields to dump (all by default)
+    :return list: Entries as dicts {<field name>: <value as string>}
+    """
+    return [entry for chunk in iterate(query, fields) for entry in chunk]
@@ -14,6 +14,20 @@ DB_PASSWORD = 'redhat'
 DB_TABLE = 'sku_attributes_all'
 DB_PORT = int(os.environ.get('OPENSHIFT_MYSQL_DB_PORT', 40466))
 
+# Number of rows fetched from the database at once when dumping search results
+SEARCH_CHUNK = 1000
+
+# Search results cache: maximum size (in bytes of JSON) and how often (in
+# seconds) the table is checked for changes
+SEARCH_CACHE_SIZE = 64 * 1024 * 1024
+SEARCH_CACHE_CHECK = 30
+
+# Search engine: 'sql' queries the database, 'catalog' searches a copy of the
+# SKU table held in memory (requires NumPy, falls back to 'sql' otherwise) and
+# how often (in seconds) the copy is checked for changes
+SEARCH_ENGINE = os.environ.get('ETHEL_SEARCH_ENGINE', 'sql')
+CATALOG_REFRESH = 60
+
 # Url to report bugs in this tool
 REPORT_URL = (
     "https://engineering.redhat.com/trac/content-tests/newticket?component="
@@ -32,3 +46,19 @@ DOCUMENTATION_URL = \
 # 'MM/DD/YYYY' format to maintain compatibility.
 # NOTE: Restart server to take effect
 CANDLEPIN_REFRESH_DATE = ''
+
+# Maximum number of SKUs attached to one account at once
+ATTACH_PARALLELISM = 5
+
+# Background jobs: maximum number of jobs running at once, number of items of
+# batch jobs (eg. imported accounts) processed at once, number of jobs kept in
+# memory and time (in seconds) for how long finished jobs are kept
+MAX_JOBS_RUNNING = 4
+JOB_ITEM_WORKERS = 10
+MAX_JOBS = 100
+JOB_TTL = 3600
+
+# Bulk import: accounts imported at once within one import and maximum number
+# of accounts started per second across all imports
+IMPORT_PARALLELISM = 5
+IMPORT_RATE = 2
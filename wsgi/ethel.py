@@ -1,17 +1,22 @@
 import os
 import logging
-from datetime import datetime, timedelta
+import operator
+from datetime import datetime
 from inspect import getargspec
 from json import dumps
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 from flask_bootstrap import Bootstrap
 
 import forms as f
-from database import LAYOUT, SkuEntry
+from database import DB, LAYOUT, SkuEntry, iterate, serialize, table_version
 from choices import CHOICES
 import candlepin
 import utils
+import accounts
+import cache
+import catalog
+import jobs
 import environment as env
 
 __author__ = "tcoufal"
@@ -20,6 +25,16 @@ __author__ = "tcoufal"
 app = Flask(__name__)
 bootstrap = Bootstrap(app)
 
+# Rate of accounts imported, shared by all bulk imports
+IMPORT_LIMITER = jobs.RateLimiter(env.IMPORT_RATE)
+
+# Results of recent searches, shared by all requests
+SEARCH_CACHE = cache.SearchCache(env.SEARCH_CACHE_SIZE, env.SEARCH_CACHE_CHECK)
+
+# In-memory SKU catalog searched instead of the database (optional)
+CATALOG = catalog.start(env.CATALOG_REFRESH) \
+    if env.SEARCH_ENGINE == 'catalog' else None
+
 
 @app.errorhandler(404)
 def page_not_found(e):
@@ -65,6 +80,38 @@ def index():
                            **forms)
 
 
+def __dispatch(raw_data, kind, operation):
+    """
+    Execute the operation and send its response
+
+    If the request opts in for the asynchronous mode ('async': true), the
+    operation is enqueued as a background job instead and the job's ID is sent
+    right away. The operation's response is then available as the job's result
+    via '/job/<job id>'. Either way the operation runs within a time budget
+    (see candlepin.budget).
+    :param raw_data: Request's data
+    :param kind: Operation identifier
+    :param operation: Callable returning the response dict
+                      {'status': <status_code>, 'msg': <response msg>, ...}
+    :return dict: {'status': <status_code>, 'msg': <response msg>, ...}
+    :return int: Status code
+    """
+    def bounded():
+        with candlepin.budget.limit(candlepin.OPERATION_DEADLINE):
+            return operation()
+
+    if raw_data.get('async') is not True:
+        response = bounded()
+        return dumps(response), int(response['status'])
+
+    job = jobs.register(jobs.Job(kind))
+    jobs.run(job, bounded)
+    response = {'status': '200', 'data': {'job': job.id},
+                'msg': "Operation '{0}' enqueued as job '{1}'".format(kind,
+                                                                      job.id)}
+    return dumps(response), 200
+
+
 @app.route('/account/new', methods=['POST'])
 @utils.exception_handler
 def account_new():
@@ -75,7 +122,8 @@ def account_new():
         'username': <account's username>,
         'password': <account's password>,
         'first_name': <optional>,
-        'last_name': <optional>
+        'last_name': <optional>,
+        'async': <optional, run as a background job if true>
     }
     :return dict: {'status': <status_code>, 'msg': <response data>}
     :return int: Status code
@@ -87,14 +135,15 @@ def account_new():
     }
     create_data = utils.validate_input(template, data)
 
-    # Create user
-    candlepin.account.create_new(**create_data)
-    # NOTE: Account is inactive by default
+    def operation():
+        # Create user
+        candlepin.account.create_new(**create_data)
+        # NOTE: Account is inactive by default
 
-    response = {'status': '200',
+        return {'status': '200',
                 'msg': "Account '{0}' created".format(data['username'])}
 
-    return dumps(response), 200
+    return __dispatch(data, 'new', operation)
 
 
 @app.route('/account/activate', methods=['POST'])
@@ -105,7 +154,8 @@ def account_activate():
 
     Accept all Terms and Conditions applicable to the account
 
-    :input data: {'username': <username>, 'password': <password>}
+    :input data: {'username': <username>, 'password': <password>,
+                  'async': <optional, run as a background job if true>}
     :return dict: {
         'status': <status_code>,
         'msg': <response msg>
@@ -117,20 +167,26 @@ def account_activate():
     template = {'required': ('username', 'password')}
     data = utils.validate_input(template, raw_data)
 
-    # Verify the given credentials
-    candlepin.account.verify(data['username'], data['password'])
+    def operation():
+        # Facts about the account are fetched once for the whole request
+        context = candlepin.AccountContext(data['username'], data['password'])
+
+        # Verify the given credentials
+        candlepin.account.verify(data['username'], data['password'],
+                                 context=context)
 
-    # Accept all necessary Terms and Conditions
-    org_id = candlepin.utils.get_orgid(data['username'])
-    r = candlepin.account.accept_terms(data['username'], data['password'],
-                                       org_id=org_id)
-    if r['failed']:
-        raise RuntimeError("Failed to accept some Ts&Cs for account '{0}': {1}"
-                           "".format(data['username'], r['failed']))
+        # Accept all necessary Terms and Conditions
+        r = candlepin.account.accept_terms(data['username'], data['password'],
+                                           context=context)
+        if r['failed']:
+            raise RuntimeError("Failed to accept some Ts&Cs for account '{0}':"
+                               " {1}".format(data['username'], r['failed']))
 
-    msg = ("Terms and Conditions for account '{0}' were successfully accepted"
-           "".format(data['username']))
-    return dumps({'status': '200', 'msg': msg}), 200
+        msg = ("Terms and Conditions for account '{0}' were successfully "
+               "accepted".format(data['username']))
+        return {'status': '200', 'msg': msg}
+
+    return __dispatch(raw_data, 'activate', operation)
 
 
 @app.route('/account/get', methods=['GET'])
@@ -139,7 +195,16 @@ def account_get():
     """
     Account Manager handler for AJAX - View Account
 
-    :input data: {'username': <username>, 'password': <password>}
+    Pools can be filtered and paginated on the server. With 'stream=ndjson'
+    the response is streamed as newline delimited JSON instead: the first line
+    contains the account info, each following line one pool (as soon as its
+    quantity is resolved).
+    :input data: {'username': <username>, 'password': <password>,
+                  'type': <optional, pool type, 'normal' by default, 'all'>,
+                  'sku_prefix': <optional, list SKUs with this prefix only>,
+                  'offset': <optional, number of pools to skip>,
+                  'limit': <optional, maximum number of pools to list>,
+                  'stream': <optional, 'ndjson'>}
     :return dict: {
         'status': <status_code>,
         'msg': <response msg in case of error>,
@@ -149,15 +214,49 @@ def account_get():
     """
     logging.debug("Account details requested")
     raw_data = request.args
-    template = {'required': ('username', 'password')}
+    template = {
+        'required': ('username', 'password'),
+        'optional': ('type', 'sku_prefix', 'offset', 'limit', 'stream')
+    }
     data = utils.validate_input(template, raw_data)
 
+    page = dict()
+    for param in ('offset', 'limit'):
+        try:
+            if param in data:
+                page[param] = int(data[param])
+                assert page[param] >= 0
+        except (ValueError, AssertionError):
+            raise AssertionError(param, 'Has to be a non-negative integer')
+    pool_type = data.get('type', 'normal')
+
     # NOTE: Verification of the account is done during the data retrieval
     # bellow. No need to pool the API twice.
     # Get account details
-    info = candlepin.account.get_details(data['username'], data['password'])
-    response = {'status': '200', 'data': info}
-    return dumps(response), 200
+    # NOTE: Multipliers are resolved via SKU Attributes DB where possible
+    with candlepin.budget.limit(candlepin.OPERATION_DEADLINE):
+        info, pools = candlepin.account.iter_details(
+            data['username'], data['password'], resolver=utils.get_multipliers,
+            pool_type=None if pool_type == 'all' else pool_type,
+            sku_prefix=data.get('sku_prefix'), **page)
+
+    if data.get('stream') != 'ndjson':
+        pools = list(pools)
+        info.update(pools=pools, partial=any(p.get('raw') for p in pools))
+        response = {'status': '200', 'data': info}
+        return dumps(response), 200
+
+    def generate():
+        yield dumps(info) + '\n'
+        try:
+            for pool in pools:
+                yield dumps(pool) + '\n'
+        except Exception as e:
+            # headers are sent already, report the error in the stream
+            logging.error("[Account Info] streaming failed: {0}".format(e))
+            yield dumps({'status': '500', 'msg': str(e)}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 
 @app.route('/account/attach', methods=['POST'])
@@ -166,16 +265,25 @@ def account_attach():
     """
     Account Manager handler for AJAX - Attach Subscription to an Account
 
+    Pools for all SKUs are created in a single order, then they are activated
+    independently (see accounts.attach()).
     :input data: {
         'username': <account's username>,
         'password': <account's password>,
         'sku': <list of SKUs to attach>,
         'quantity': <quantity effective to all SKUs listed above>
-        'expire': <date of SKU Subscription expiration>
+        'expire': <date of SKU Subscription expiration>,
+        'async': <optional, run as a background job if true>
     }
     In case the 'quantity' is not specified or it's malformed, the value is set
     to 1.
-    :return dict: {'status': <status_code>, 'msg': <response data>}
+    :return dict: {
+        'status': <status_code>,
+        'msg': <response data>,
+        'data': {<sku>: {'regnum': <created regnum>,
+                         'activated': <bool>,
+                         'error': <error message or None>}}
+    }
     :return int: Status code
     """
     logging.debug("Attaching subscription")
@@ -192,33 +300,101 @@ def account_attach():
         raise AssertionError('expire', *utils.VALIDATORS['expire'][1:])
     data = utils.validate_input(template, raw_data)
 
-    # Verify the account is available and active
-    candlepin.account.verify(data['username'], data['password'])
+    def operation():
+        # Facts about the account are fetched once for the whole request
+        context = candlepin.AccountContext(data['username'], data['password'])
 
-    # Initiate the attachment process
-    org_id = candlepin.utils.get_orgid(data['username'])
+        # Verify the account is available and active
+        candlepin.account.verify(data['username'], data['password'],
+                                 context=context)
 
-    # Subscription is 1 year long, compute the creation date to meet expiration
-    if 'expire' in data.keys():
-        start = data['expire'].date() - timedelta(days=364)
-    else:
-        start = datetime.today().date()
-
-    failed = list()
-    for sku in data['sku']:
-        if not utils.check_sku(sku):
-            failed.append(sku)
-            continue
-        num = candlepin.subscription.create_pool(data['username'], sku,
-                                                 data['quantity'], start)
-        candlepin.account.activate_pool(data['username'], org_id, num, start)
+        # Initiate the attachment process
+        start = accounts.start_date(data.get('expire'))
+        result = accounts.attach(
+            data['username'], [(sku, data['quantity']) for sku in data['sku']],
+            start, context=context)
 
-    if failed:
-        raise AssertionError('sku ({0})'.format(failed))
+        failed = [sku for sku in data['sku'] if result[sku]['error']]
+        if failed:
+            return {'status': '400', 'data': result,
+                    'msg': "Failed to attach these SKUs to '{0}' account: {1}"
+                           "".format(data['username'], failed)}
 
-    response = {'status': '200',
+        return {'status': '200', 'data': result,
                 'msg': "These SKUs have been attached to '{0}' account: {1}"
                        "".format(data['username'], data['sku'])}
+
+    return __dispatch(raw_data, 'attach', operation)
+
+
+@app.route('/account/import', methods=['POST'])
+@utils.exception_handler
+def account_import():
+    """
+    Account Manager handler for AJAX - Bulk Import
+
+    The CSV file is parsed on the server and accounts are imported by a
+    background job (see accounts.import_account()), its progress is available
+    via '/job/<job id>'.
+    :input data: multipart form: {
+        'file': <CSV file, line format: username,password[,sku,quantity]...>,
+        'terms': <optional, 'true' if Ts&Cs should be accepted>
+    }
+    :return dict: {
+        'status': <status_code>,
+        'msg': <response msg>,
+        'data': {'job': <job id>}
+    }
+    :return int: Status code
+    """
+    logging.debug("Bulk import requested")
+    try:
+        csv_file = request.files['file']
+    except KeyError:
+        raise SyntaxError('file')
+    activate = request.form.get('terms', '').lower() in ('true', 'y', 'on')
+
+    # Parse the file, keep passwords out of the job's (public) description
+    job = jobs.Job('import')
+    passwords = list()
+    for account in accounts.parse_csv(csv_file.stream):
+        index = job.add_item({'username': account['username'],
+                              'pools': account['pools']})
+        passwords.append(account['password'])
+        if account['error']:
+            job.update_item(index, status='failed', error=account['error'])
+
+    def import_row(index):
+        item = job.items[index]
+        IMPORT_LIMITER.wait()
+        with candlepin.budget.limit(candlepin.OPERATION_DEADLINE):
+            accounts.import_account(
+                item['username'], passwords[index], item['pools'], activate,
+                progress=lambda step: job.update_item(index, step=step))
+
+    jobs.register(job)
+    jobs.run_each(job, import_row, limit=env.IMPORT_PARALLELISM)
+
+    response = {'status': '200', 'data': {'job': job.id},
+                'msg': "Import of {0} accounts started".format(
+                    len(job.items))}
+    return dumps(response), 200
+
+
+@app.route('/job/<job_id>', methods=['GET'])
+@utils.exception_handler
+def job_status(job_id):
+    """
+    Background job status handler for AJAX
+
+    :return dict: {
+        'status': <status_code>,
+        'msg': <response msg in case of error>,
+        'data': <job details, see jobs.Job.dict()>
+    }
+    :return int: Status code
+    """
+    response = {'status': '200', 'data': jobs.get(job_id).dict()}
     return dumps(response), 200
 
 
@@ -230,7 +406,8 @@ def subscriptions_refresh():
 
     :input data: {
         'username': <account's username>,
-        'password': <account's password>
+        'password': <account's password>,
+        'async': <optional, run as a background job if true>
     }
     :return dict: {'status': <status_code>, 'msg': <response data>}
     :return int: Status code
@@ -240,14 +417,53 @@ def subscriptions_refresh():
     template = {'required': ('username', 'password')}
     data = utils.validate_input(template, raw_data)
 
-    # Verify the account is available and active
-    candlepin.account.verify(data['username'], data['password'])
+    def operation():
+        # Facts about the account are fetched once for the whole request
+        context = candlepin.AccountContext(data['username'], data['password'])
 
-    # Initiate the refresh
-    candlepin.subscription.refresh_pools(data['username'])
-    response = {'status': '200',
+        # Verify the account is available and active
+        candlepin.account.verify(data['username'], data['password'],
+                                 context=context)
+
+        # Initiate the refresh
+        candlepin.subscription.refresh_pools(data['username'],
+                                             context=context)
+        return {'status': '200',
                 'msg': "Pools for '{0}' refreshed successfully".format(
                     data['username'])}
+
+    return __dispatch(raw_data, 'refresh', operation)
+
+
+@app.route('/stats', methods=['GET'])
+@utils.exception_handler
+def stats():
+    """
+    Statistics handler for AJAX
+
+    Reports how efficient the caches (including the search results cache) and
+    connection pools are and how healthy the upstream services look like.
+    :return dict: {'status': <status_code>,
+                   'data': {'caches': {<cache name>: <cache statistics>},
+                            'connections': <UEPConnection pool statistics>,
+                            'breakers': {<endpoint>: <breaker statistics>},
+                            'limiter': <calls limiter statistics>,
+                            'hedging': {<endpoint>: <hedging statistics>},
+                            'singleflight': {<group>: <group statistics>},
+                            'search': <search results cache statistics>,
+                            'catalog': <SKU catalog statistics or None>}}
+    :return int: Status code
+    """
+    breakers = candlepin.breaker.BREAKERS.items()
+    response = {'status': '200',
+                'data': {'caches': candlepin.cache.stats(),
+                         'connections': candlepin.connections.POOL.stats(),
+                         'breakers': {k: v.stats() for k, v in breakers},
+                         'limiter': candlepin.breaker.LIMITER.stats(),
+                         'hedging': candlepin.hedging.stats(),
+                         'singleflight': candlepin.singleflight.stats(),
+                         'search': SEARCH_CACHE.stats(),
+                         'catalog': CATALOG.stats() if CATALOG else None}}
     return dumps(response), 200
 
 
@@ -259,12 +475,28 @@ def search():
     Search handler for AJAX.
 
     Triggers a query to DB based on a POST JSON data. The result is dumped as a
-    JSON in response.
+    JSON in response. When the filters are sent as a list, all matching entries
+    are returned. When they are wrapped in a dict (DataTables server-side
+    processing), only the requested page is returned.
     :input data: [{'key': <column_criterian>,
                    'operator': <compare_function_key>,
                                # specfied in the CHOICES['compare']
                    'value': <value_to_compare_against>},.. ]
+                 or {'filters': <list of filters as above>,
+                     'draw': <request counter, sent back>,
+                     'start': <offset of the page>,
+                     'length': <page size, -1 for all>,
+                     'order': [{'column': <index in 'columns'>,
+                                'dir': <'asc' or 'desc'>},..],
+                     'columns': [{'data': <column name>},..],
+                     'search': {'value': <optional, global search term>},
+                     'fields': <optional, list of columns to send, the SKU
+                                ID is always sent>}
+    :input args: 'stream': <optional, 'json' or 'ndjson' to stream the data>
     :return dict: {'status': <status_code>, 'data': <response data>}
+                  with 'draw', 'recordsTotal' (entries matching the filters)
+                  and 'recordsFiltered' (matching the search term as well) in
+                  the server-side mode
     :return int: Status code
     """
     logging.debug("Search requested")
@@ -274,12 +506,94 @@ def search():
     except:
         raise RuntimeError('Query cannot be parsed')
 
-    query = SkuEntry.select()
-
     logging.debug("Search initiated with query: {0}".format(data))
 
-    # chain the where clause
-    for item in data:
+    # large results can be streamed instead, those are not cached
+    mode = request.args.get('stream')
+    key = None
+    if mode not in ('json', 'ndjson'):
+        SEARCH_CACHE.check(table_version)
+        # the results are stored only if the table doesn't change meanwhile
+        version = SEARCH_CACHE.version
+        try:
+            key = cache.normalize(data)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+            # not a valid query, let the query builder report it
+            pass
+
+    # the cached responses are encoded already, without the 'draw' counter
+    draw = data.get('draw') if isinstance(data, dict) else None
+    cached = SEARCH_CACHE.get(key) if key is not None else None
+    if cached is not None:
+        logging.debug("Search done (cached)")
+        return __with_draw(cached, draw), 200
+
+    if isinstance(data, dict):
+        filters = __search_filters(data.get('filters', []))
+        params = __search_params(data)
+    else:
+        filters, params = __search_filters(data), None
+    response = {'status': '200'}
+
+    # evaluate the search in memory if the catalog is loaded
+    result = None
+    if CATALOG is not None and mode not in ('json', 'ndjson'):
+        result = CATALOG.search(filters, params, version)
+
+    if result is not None:
+        total, filtered, entries = result
+    else:
+        query = __search_query(filters)
+        if params is not None:
+            total, filtered, query = __search_page(query, params)
+        else:
+            # sort data
+            query = query.order_by(SkuEntry.id)
+
+    if params is not None:
+        response.update(recordsTotal=total, recordsFiltered=filtered)
+
+    fields = params and params['fields']
+    if mode in ('json', 'ndjson'):
+        logging.debug("Search streamed as {0}".format(mode))
+        if params is not None:
+            response['draw'] = draw
+        return __search_stream(response, query, fields, mode)
+
+    # send json with data as response
+    if result is None:
+        entries = serialize(query, fields)
+    response['data'] = entries
+    body = utils.encode(response)
+    if key is not None:
+        SEARCH_CACHE.set(key, body, len(body), version)
+
+    logging.debug("Search done")
+    return __with_draw(body, draw), 200
+
+
+def __with_draw(body, draw):
+    """
+    Add the DataTables' request counter to an encoded search response
+
+    :param body: The response encoded as a JSON object
+    :param draw: The request counter, None if not in the server-side mode
+    :return str: The response with the 'draw' member
+    """
+    if draw is None:
+        return body
+    return '{{"draw": {0}, {1}'.format(utils.encode(draw), body[1:])
+
+
+def __search_filters(filters):
+    """
+    Validate the filters
+
+    :param filters: [{'key', 'operator', 'value'},..], see search()
+    :return list: [(<field>, <operator name>, <list of operator's values>),..]
+    """
+    parsed = list()
+    for item in filters:
         try:
             # get proper column of db layout
             field = SkuEntry._meta.fields[item['key']]
@@ -288,9 +602,9 @@ def search():
             op = CHOICES['compare'][field.db_field][item['operator']]
 
             # if we're expecting two arguments, let's look for a value.
-            args = [field]
+            values = list()
             if len(getargspec(op)[0]) == 2:
-                args.append(item['value'])
+                values.append(item['value'])
 
                 # check if the value respects the db field
                 ftype = CHOICES['field_type'][field.db_field]
@@ -300,16 +614,154 @@ def search():
             logging.warning("[Search] Invalid query: {0}".format(item))
             raise RuntimeError("'{0}' is not a valid query".format(item))
 
-        query = query.where(op(*args))
+        parsed.append((field, item['operator'], values))
+    return parsed
 
-    # sort data
-    query.order_by(SkuEntry.id)
 
-    # send json with data as response
-    response = [item.dict() for item in query]
+def __search_params(data):
+    """
+    Validate paging, sorting, search and projection parameters (DataTables
+    server-side mode)
+
+    :param data: Search request, see search()
+    :return dict: {'start': <offset>, 'length': <page size, -1 for all>,
+                   'term': <global search term or None>,
+                   'order': [(<field>, <True if descending>),..],
+                   'fields': <list of fields to send or None for all>}
+    """
+    try:
+        start = int(data.get('start', 0))
+        length = int(data.get('length', -1))
+        assert start >= 0
+    except (TypeError, ValueError, AssertionError):
+        raise AssertionError('start', 'Paging has to be set by integers')
+
+    columns = data.get('columns') or []
+    order = list()
+    try:
+        for item in data.get('order') or []:
+            field = SkuEntry._meta.fields[columns[int(item['column'])]['data']]
+            order.append((field, item.get('dir') == 'desc'))
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise AssertionError('order', "'{0}' is not a valid order".format(
+            data.get('order')))
+
+    # send only the requested columns
+    fields = None
+    if data.get('fields'):
+        try:
+            names = ['id'] + [n for n in data['fields'] if n != 'id']
+            fields = [SkuEntry._meta.fields[name] for name in names]
+        except (KeyError, TypeError):
+            raise AssertionError('fields', "'{0}' is not a valid list of "
+                                 "columns".format(data['fields']))
 
-    logging.debug("Search done")
-    return dumps({'status': '200', 'data': response}), 200
+    return {'start': start, 'length': length, 'order': order,
+            'term': (data.get('search') or {}).get('value') or None,
+            'fields': fields}
+
+
+def __search_query(filters):
+    """
+    Build the search query from the filters
+
+    :param filters: Validated filters, see __search_filters()
+    :return SelectQuery: The query
+    """
+    query = SkuEntry.select()
+
+    # chain the where clause
+    for field, name, values in filters:
+        op = CHOICES['compare'][field.db_field][name]
+        query = query.where(op(field, *values))
+
+    return query
+
+
+def __search_page(query, params):
+    """
+    Select the requested page of search results (DataTables server-side mode)
+
+    The global search term is matched against all string columns. Entries are
+    sorted by the requested columns and by SKU, so the pages are stable.
+    :param query: The query with filters applied, see __search_query()
+    :param params: Paging, sorting and search parameters, see
+                   __search_params()
+    :return tuple: (<number of entries matching the filters>,
+                    <number of entries matching the search term as well>,
+                    <query selecting the page>)
+    """
+    total = query.count()
+
+    term = params['term']
+    if term:
+        fields = [f for f in SkuEntry._meta.sorted_fields
+                  if f.db_field == 'string']
+        query = query.where(reduce(operator.or_,
+                                   [f.contains(term) for f in fields]))
+    filtered = query.count() if term else total
+
+    # sort data, SKU ID makes the order unique
+    order_by = [field.desc() if desc else field.asc()
+                for field, desc in params['order']]
+    query = query.order_by(*(order_by + [SkuEntry.id]))
+
+    if params['length'] >= 0:
+        query = query.offset(params['start']).limit(params['length'])
+
+    return total, filtered, query
+
+
+def __search_stream(response, query, fields, mode):
+    """
+    Stream search results chunk by chunk (see database.iterate())
+
+    'json' mode sends the same JSON object as the regular response, 'ndjson'
+    mode sends the response (without data) on the first line and then one
+    entry per line.
+    :param response: Response dict without the 'data'
+    :param query: The query selecting the entries
+    :param fields: List of fields to send (all by default)
+    :param mode: 'json' or 'ndjson'
+    :return Response: Streamed response
+    """
+    def generate():
+        # the connection opened for the request is closed by now
+        DB.connect()
+        opened = False
+        try:
+            if mode == 'ndjson':
+                yield utils.encode(response) + '\n'
+                for chunk in iterate(query, fields, unbuffered=True):
+                    yield '\n'.join(utils.encode(e) for e in chunk) + '\n'
+                return
+
+            head = utils.encode(response)[:-1] + ', "data": ['
+            opened = True
+            yield head
+            separator = ''
+            for chunk in iterate(query, fields, unbuffered=True):
+                yield separator + ', '.join(utils.encode(e) for e in chunk)
+                separator = ', '
+            yield ']}'
+
+        except Exception as e:
+            # headers are sent already, report the error in the stream
+            logging.error("[Search] streaming failed: {0}".format(e))
+            error = {'status': '500', 'msg': str(e)}
+            if mode == 'ndjson':
+                yield utils.encode(error) + '\n'
+            elif opened:
+                # close the data array, the entries sent are incomplete
+                yield '], "error": {0}}}'.format(utils.encode(error))
+            else:
+                yield utils.encode(dict(response, error=error))
+        finally:
+            DB.close()
+
+    mimetype = 'application/x-ndjson' if mode == 'ndjson' else \
+        'application/json'
+    return Response(generate(), mimetype=mimetype)
 
 if __name__ == '__main__':
     print "This file is not supposed to be run as is."
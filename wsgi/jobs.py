@@ -0,0 +1,289 @@
+"""
+Background jobs
+
+Long running operations are executed in a bounded pool of background workers,
+separate from the HTTP workers. Each job is tracked by an ID, so the client
+can poll for its progress and result.
+
+NOTE: Jobs are kept in the memory of the process which accepted them, status
+requests have to reach the same process (eg. a single gunicorn worker with
+more threads).
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import candlepin
+import environment as env
+
+__author__ = "tcoufal"
+
+# Registry of jobs: {<job id>: <Job instance>}
+JOBS = OrderedDict()
+_lock = threading.Lock()
+
+
+class Job(object):
+    """
+    A background job and its progress
+
+    A job consists of items (eg. rows of an import), each item has its own
+    status and result.
+    """
+
+    def __init__(self, kind, items=None):
+        """
+        :param kind: Job type identifier (eg. 'import')
+        :param items: List of item descriptions (dicts)
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'pending'
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.items = list()
+        self._remaining = 0
+        self._lock = threading.Lock()
+        for item in items or []:
+            self.add_item(item)
+
+    def add_item(self, item):
+        """
+        Add an item to process
+        :param item: Description of the item (dict)
+        :return int: Index of the item
+        """
+        with self._lock:
+            entry = dict(item, status='pending', steps=list(), error=None)
+            self.items.append(entry)
+            self._remaining += 1
+            return len(self.items) - 1
+
+    def update_item(self, index, status=None, step=None, error=None):
+        """
+        Update progress of an item
+        :param index: Index of the item
+        :param status: New status ('running', 'done', 'failed')
+        :param step: Description of a finished step to append
+        :param error: Error message
+        """
+        with self._lock:
+            item = self.items[index]
+            if status:
+                item['status'] = status
+            if step:
+                item['steps'].append(step)
+            if error:
+                item['error'] = error
+            if status == 'running' and self.status == 'pending':
+                self.status = 'running'
+
+    def start(self):
+        """
+        Mark the job as running
+        """
+        with self._lock:
+            self.status = 'running'
+
+    def item_finished(self):
+        """
+        Count an item as finished, the job is finished with the last one
+        """
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            self.finish(result=self.summary())
+
+    def summary(self):
+        """
+        :return dict: Number of items in each state
+        """
+        with self._lock:
+            counts = dict.fromkeys(('pending', 'running', 'done', 'failed'), 0)
+            for item in self.items:
+                counts[item['status']] += 1
+            counts['total'] = len(self.items)
+            return counts
+
+    def finish(self, result=None, error=None):
+        """
+        Mark the job as finished
+        :param result: Result of the job
+        :param error: Error message in case the job failed
+        """
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.status = 'failed' if error else 'done'
+            self.finished = time.time()
+
+    def is_finished(self):
+        """
+        :return bool: True if the job is done (or failed)
+        """
+        return self.status in ('done', 'failed')
+
+    def dict(self):
+        """
+        Dump job to dict for the status response
+        """
+        progress = self.summary()
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'created': self.created,
+                'finished': self.finished,
+                'progress': progress,
+                'items': [dict(item, steps=list(item['steps']))
+                          for item in self.items],
+                'result': self.result,
+                'error': self.error
+            }
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of operations across all threads
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: Maximum number of operations per second
+        """
+        self.interval = 1.0 / rate
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next operation is allowed to start
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(start - now, 0))
+
+
+def __prune():
+    """
+    Forget jobs finished more than env.JOB_TTL seconds ago and make room for a
+    new job by forgetting the oldest finished ones (called with the lock held)
+    """
+    now = time.time()
+    for job_id, job in JOBS.items():
+        if job.is_finished() and now - job.finished > env.JOB_TTL:
+            del JOBS[job_id]
+
+    finished = sorted((job.finished, job_id) for job_id, job in JOBS.items()
+                      if job.is_finished())
+    while len(JOBS) >= env.MAX_JOBS and finished:
+        del JOBS[finished.pop(0)[1]]
+
+
+def register(job):
+    """
+    Add the job to the registry
+
+    Only unfinished jobs count towards the env.MAX_JOBS limit, finished ones
+    are forgotten to make room for new jobs.
+    :param job: Job instance
+    :return Job: The job
+    """
+    with _lock:
+        __prune()
+        if len(JOBS) >= env.MAX_JOBS:
+            # nothing left to forget, all the jobs are in progress
+            raise RuntimeError('Too many jobs in progress, please try again '
+                               'later')
+        JOBS[job.id] = job
+    return job
+
+
+def get(job_id):
+    """
+    Look up a job
+    :param job_id: Job identifier
+    :return Job: The job
+    """
+    with _lock:
+        try:
+            return JOBS[job_id]
+        except KeyError:
+            raise NameError("Job '{0}' doesn't exist".format(job_id))
+
+
+def run(job, func, *args, **kwargs):
+    """
+    Execute the job in the background
+
+    'func' is called in a background worker, its return value (a response dict
+    {'status': <status_code>, 'msg': <response msg>, ...}) is stored as the
+    job's result. The job is marked as failed in case of exception or if the
+    response status is not '200'.
+    :param job: Registered Job instance
+    :param func: Callable to execute
+    :return Job: The job
+    """
+    def execute():
+        job.start()
+        try:
+            result = func(*args, **kwargs)
+            error = None
+            if result.get('status', '200') != '200':
+                error = result.get('msg')
+            job.finish(result=result, error=error)
+        except Exception as e:
+            logging.error("[Job] {0} '{1}' failed: {2}".format(job.kind,
+                                                               job.id, e))
+            job.finish(error=getattr(e, 'message', None) or str(e))
+
+    pool = candlepin.executor.get_pool('jobs', env.MAX_JOBS_RUNNING)
+    pool.submit(execute)
+    return job
+
+
+def run_each(job, func, limit=None):
+    """
+    Execute the job's items in the background
+
+    'func' is called with the index of each item in a background worker, up to
+    'limit' items of the job at once. The item is marked as done when 'func'
+    returns, or as failed in case of exception. The job is finished with its
+    last item.
+    :param job: Registered Job instance
+    :param func: Callable taking the item's index
+    :param limit: Maximum number of the job's items processed at once
+    :return Job: The job
+    """
+    def execute(index):
+        job.update_item(index, status='running')
+        try:
+            func(index)
+        except Exception as e:
+            logging.error("[Job] {0} '{1}' item {2} failed: {3}"
+                          "".format(job.kind, job.id, index, e))
+            job.update_item(index, status='failed',
+                            error=getattr(e, 'message', None) or str(e))
+        else:
+            job.update_item(index, status='done')
+        job.item_finished()
+
+    pending = [i for i, item in enumerate(job.items)
+               if item['status'] == 'pending']
+    # items which failed already (eg. when parsing) are counted as finished
+    for i in range(len(job.items) - len(pending)):
+        job.item_finished()
+    if not job.items:
+        job.finish(result=job.summary())
+
+    pool = candlepin.executor.get_pool('job-items', env.JOB_ITEM_WORKERS)
+    pool.map(execute, pending, limit=limit)
+    return job
@@ -214,7 +214,19 @@ function InitViewAccountTable (data) {
     columns: [
       {title: 'Subscription ID', data: 'sku'},
       {title: 'Product Name', data: 'name'},
-      {title: 'Quantity', data: 'quantity'},
+      {
+        title: 'Quantity',
+        data: 'quantity',
+        // quantity which could not be corrected by multipliers is marked
+        render: function (quantity, type, row) {
+          if (type !== 'display' || !row.raw) {
+            return quantity
+          }
+          return quantity + ' <span class="text-warning" title="Raw quantity: ' +
+            $('<div>').text(row.error).html().replace(/"/g, '&quot;') +
+            '">(raw)</span>'
+        }
+      },
       {title: 'Subscription pool', data: 'id'}
     ],
     colReorder: true,
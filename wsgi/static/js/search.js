@@ -10,6 +10,9 @@
 
 /* global $, Toast, layout, __serializeForm, URL, Blob */
 
+// filters of the current search, the table pages are fetched with them
+var searchFilters = []
+
 // set the default value on load to prevent keeping the old data (if changed)
 /**
  * Initial values in forms
@@ -265,7 +268,8 @@ function searchTableError (e, settings, techNote, message) {
  * Set up the DataTables:
  *   - error and loading handlers
  *   - column layout
- *   - how the query is done (AJAX setup)
+ *   - how the query is done (AJAX setup, each page is requested from the
+ *     server along with the sorting)
  *   - visual settings
  * Add the column visibility button separately and and adjust general appearance
  * @param {string} url - the AJAX endpoint
@@ -276,9 +280,13 @@ function searchTableInit (url, data, layout) {
   // compute the table column layout form global 'layout' variable
   var cols = []
   for (var i = 0; i < layout.length; i++) {
-    cols.push({'data': layout[i]})
+    // hidden columns are not sent by the server
+    cols.push({'data': layout[i], 'defaultContent': ''})
   }
 
+  // remember the filters for downloading
+  searchFilters = data
+
   // disable default error handler
   $.fn.dataTable.ext.errMode = 'none'
 
@@ -293,11 +301,17 @@ function searchTableInit (url, data, layout) {
     // initialize DataTables
     .DataTable({
       stateSave: true, // remember shown columns
+      serverSide: true, // page, sort and count on the server
       ajax: { // set up the data retrieval process
         url: '/search',
         type: 'POST',
-        data: function (d) {
-          return JSON.stringify(data)
+        data: function (d, settings) {
+          // request only the visible columns
+          var fields = []
+          new $.fn.dataTable.Api(settings).columns().every(function () {
+            if (this.visible()) fields.push(this.dataSrc())
+          })
+          return JSON.stringify($.extend({}, d, {filters: data, fields: fields}))
         },
         dataType: 'json',
         contentType: 'application/json'
@@ -313,6 +327,11 @@ function searchTableInit (url, data, layout) {
       }
     })
 
+  // a column shown later is not loaded yet, reload the current page
+  table.off('column-visibility.dt').on('column-visibility.dt', function (e, settings, column, state) {
+    if (state) table.ajax.reload(null, false)
+  })
+
   // make the table flat (no wrap on lines, use horizontal scroll instead)
   $('#search_result .datatable').wrap('<div style="overflow:auto;white-space:nowrap;" />')
 
@@ -411,9 +430,21 @@ function downloadData () {
   // bind click events for both buttons
   $('#search .download-button.download-all a').click(function (e) {
     if ($(this).parent().hasClass('disabled')) { e.preventDefault(); return }
-    // use all data
-    var raw_data = $.makeArray($('#search_result .datatable').DataTable().data())
-    download(e, raw_data)
+    // the table holds the current page only, fetch all data matching the
+    // filters first and click the link again once they are ready
+    if ($(this).attr('href') && $(this).attr('href').indexOf('blob:') === 0) return
+    e.preventDefault()
+    var link = this
+    $.ajax({
+      url: '/search?stream=json',
+      type: 'POST',
+      data: JSON.stringify(searchFilters),
+      dataType: 'json',
+      contentType: 'application/json'
+    }).done(function (resp) {
+      download({originalEvent: {currentTarget: link}}, resp.data)
+      link.click()
+    })
   })
   $('#search .download-button.download-selected a').click(function (e) {
     if ($(this).parent().hasClass('disabled')) { e.preventDefault(); return }
@@ -425,6 +456,7 @@ function downloadData () {
   // destroy the Blob object when not needed anymore
   $('#search .download-button').mouseup(function () {
     URL.revokeObjectURL(blob)
+    $('a', this).removeAttr('href')
   })
 }
 
@@ -1,19 +1,39 @@
 import logging
 import re
+from contextlib import contextmanager
 from functools import wraps
 from json import dumps
 from datetime import timedelta, date
+try:
+    import ujson
+except ImportError:
+    # optional, JSON is encoded by the standard library then
+    ujson = None
 
 import requests
 
+from peewee import DatabaseError
 from werkzeug.exceptions import BadRequest
 from flask import request
+from candlepin.breaker import ServiceUnavailable
 
 from database import SkuEntry, DB
 
 __author__ = "tcoufal"
 
 
+def encode(data):
+    """
+    Encode data as JSON, use the faster ujson encoder if it's available
+
+    :param data: Data to encode
+    :return str: JSON
+    """
+    if ujson is not None:
+        return ujson.dumps(data, escape_forward_slashes=False)
+    return dumps(data)
+
+
 VALIDATORS = {
     'password': (
         lambda x: 1 <= len(str(x)) <= 25,
@@ -103,6 +123,22 @@ def db_required(func):
     return decorated_request
 
 
+@contextmanager
+def db_connection():
+    """
+    Connect to the SKU Attributes DB for the block unless the thread is
+    connected already (eg. by db_required), close the connection afterwards
+    """
+    opened = DB.is_closed()
+    if opened:
+        DB.connect()
+    try:
+        yield
+    finally:
+        if opened:
+            DB.close()
+
+
 def exception_handler(func):
     """
     A decorator for Exception Handling for requests to our API.
@@ -120,11 +156,15 @@ def exception_handler(func):
 
     ValueError:         Raised when used credentials are wrong
 
+    ServiceUnavailable: Stage Candlepin is failing (circuit breaker is open)
+                        or overloaded, the call was not made
+
     RuntimeError:       The Candlepin module returned any other result then
                         success
 
     ConnectionError,
-    HTTPError:          Candlepin module is facing issues when communicating
+    HTTPError,
+    Timeout:            Candlepin module is facing issues when communicating
                         with Stage Candlepin
 
     BadRequest:         When Flask is not satisfied by user input (eg. JSON
@@ -157,13 +197,20 @@ def exception_handler(func):
                 response['msg'] += ", reason: {0}".format("".join(e.args[1:]))
             return dumps(response), 400
 
+        except ServiceUnavailable as e:
+            logging.error(e)
+            log_request(logging.error)
+            response = {'status': '503', 'msg': e.message}
+            return dumps(response), 503
+
         except (NameError, ValueError, RuntimeError) as e:
             logging.error(e)
             log_request(logging.error)
             response = {'status': '400', 'msg': e.message}
             return dumps(response), 400
 
-        except (requests.ConnectionError, requests.HTTPError) as e:
+        except (requests.ConnectionError, requests.HTTPError,
+                requests.Timeout) as e:
             logging.error("Connection error: {0}".format(e))
             log_request(logging.error)
             response = {'status': '400',
@@ -205,3 +252,67 @@ def check_sku(sku):
         logging.error("sku {0} doesn't exist in database".format(sku))
         return False
     return True
+
+
+def check_skus(skus):
+    """
+    Query the database for given SKUs at once
+    :param skus: Iterable of SKU identifiers
+    :return list: SKUs which don't exist in database
+    """
+    skus = list(skus)
+    query = SkuEntry.select(SkuEntry.id).where(
+        SkuEntry.id << [sku.upper() for sku in skus]).tuples()
+    with db_connection():
+        present = set(row[0].upper() for row in query)
+
+    missing = [sku for sku in skus if sku.upper() not in present]
+    for sku in missing:
+        logging.error("sku {0} doesn't exist in database".format(sku))
+    return missing
+
+
+def get_multipliers(skus):
+    """
+    Look up multipliers for given SKUs in the database
+
+    All SKUs are fetched in a single query. SKUs not present in the database
+    (or all of them when the database is not available) are left out, so the
+    caller can fetch them elsewhere. Multipliers which are not set or not
+    positive (eg. 'n/a', 'unlimited') are reported as 1, same as Candlepin
+    does when they are missing.
+    :param skus: Iterable of SKU identifiers
+    :return dict: {<sku>: (<multiplier>, <instance multiplier>)}
+    """
+    def to_int(value):
+        # 'n/a', 'unlimited' and NULL values don't affect the quantity
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return 1
+        return value if value > 0 else 1
+
+    lookup = {sku.upper(): sku for sku in skus}
+    if not lookup:
+        return dict()
+
+    query = SkuEntry.select(
+        SkuEntry.id, SkuEntry.multiplier, SkuEntry.instance_multiplier
+    ).where(SkuEntry.id << lookup.keys()).tuples()
+
+    try:
+        # the view doesn't require the database, connect just for the query
+        with db_connection():
+            rows = list(query)
+    except DatabaseError as e:
+        logging.warning("[Multiplier] database lookup failed: {0}".format(e))
+        return dict()
+
+    result = dict()
+    for sku, multiplier, instance_multiplier in rows:
+        if sku.upper() in lookup:
+            result[lookup[sku.upper()]] = (to_int(multiplier),
+                                           to_int(instance_multiplier))
+    logging.debug("[Multiplier] {0} of {1} SKUs found in database"
+                  "".format(len(result), len(lookup)))
+    return result